@@ -1,81 +1,54 @@
 
+import time
+_import_start = time.perf_counter()
 import os
 import sqlite3
-import smtplib
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, Response, request, jsonify, render_template, send_file, stream_with_context, url_for
+import bulk
+import cache
+import changes
+import dates
+import db
+import devices
+import export
+import jobs
+import listing
+import schema
+import search
+import stats
+import tokens
+import mailer
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+db.init_app(app)
+metrics.init_app(app)
+app.jinja_env.globals['live_updates'] = changes.LIVE_UPDATES
+metrics.startup_seconds.observe(time.perf_counter() - _import_start, 'import')
 
-# Initialize SQLite database
+# Apply pending schema migrations; a single PRAGMA read once the database is current
 def init_db():
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            c.execute('''CREATE TABLE IF NOT EXISTS rma_requests (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            month TEXT,
-                            date_of_issue TEXT,
-                            project TEXT,
-                            location TEXT,
-                            si_client TEXT,
-                            product TEXT,
-                            device_serial_number TEXT,
-                            delivered_material_date TEXT,
-                            issues_observed TEXT,
-                            emd_observation TEXT,
-                            solutions TEXT,
-                            replacement_dc_no TEXT,
-                            tested_by_messung_engineer TEXT,
-                            rma TEXT,
-                            faulty_device_status TEXT,
-                            remark TEXT,
-                            device_status TEXT,
-                            r1 TEXT,
-                            r2 TEXT,
-                            r3 TEXT,
-                            token_no TEXT UNIQUE,
-                            customer_email TEXT
-                        )''')
-            c.execute('''CREATE TABLE IF NOT EXISTS rma_sequence (
-                            id INTEGER PRIMARY KEY,
-                            last_sequence INTEGER
-                        )''')
-            c.execute("INSERT OR IGNORE INTO rma_sequence (id, last_sequence) VALUES (1, 489)")
-            conn.commit()
-            logger.info("Database initialized successfully")
+        with metrics.timed(metrics.startup_seconds, 'migrate'):
+            applied = schema.migrate(db.get_connection())
+        if applied:
+            logger.info(f"Database migrated to schema version {schema.SCHEMA_VERSION}")
     except sqlite3.Error as e:
         logger.error(f"Database initialization failed: {e}")
 
-# Generate sequential RMA token
-def generate_rma_token():
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
-    try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            c.execute("SELECT last_sequence FROM rma_sequence WHERE id = 1")
-            result = c.fetchone()
-            last_sequence = result[0] if result else 489
-            new_sequence = last_sequence + 1
-            c.execute("UPDATE rma_sequence SET last_sequence = ? WHERE id = 1", (new_sequence,))
-            conn.commit()
-            logger.info(f"Generated RMA token: MES-RMA-{new_sequence}")
-            return f"MES-RMA-{new_sequence}"
-    except sqlite3.Error as e:
-        logger.error(f"Error generating RMA token: {e}")
-        return None
+# Import modules that are otherwise loaded on first use; called in the gunicorn master with
+# preload_app so forked workers start with them already in memory
+def warm_up():
+    with metrics.timed(metrics.startup_seconds, 'warm_up'):
+        export.preload()
 
-# Send email with RMA token
-def send_rma_email(customer_email, issues_observed, device_serial_number, token_no, is_closure=False):
-    sender_email = "payal.chaudhari@messung.com"
-    sender_password = "fasmvqyajmbavkhr"  # App-specific password
+# Queue email with RMA token; delivered by the outbox worker after the transaction commits
+def queue_rma_email(conn, customer_email, issues_observed, device_serial_number, token_no, is_closure=False):
     if is_closure:
         subject = f"RMA Request Closed - Token No: {token_no}"
         body = f"""
@@ -99,60 +72,296 @@ Please use this token for all communications regarding this repair.
 Best regards,
 Messung Systems Pvt. Ltd. (Ourican Automation)
 """
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = customer_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, customer_email, msg.as_string())
-        server.quit()
-        logger.info(f"{'Closure' if is_closure else 'Confirmation'} email sent to {customer_email}")
-        return True
-    except Exception as e:
-        logger.error(f"Email sending failed: {e}")
-        return False
+    message_id = mailer.enqueue(conn, customer_email, subject, body)
+    if message_id:
+        logger.info(f"{'Closure' if is_closure else 'Confirmation'} email queued for {customer_email}")
+    return message_id is not None
+
+# Queue one closure email per customer, listing every ticket closed for them
+def queue_closure_emails(conn, closed):
+    by_customer = {}
+    for token_no, customer_email, issues_observed, device_serial_number in closed:
+        if customer_email:
+            by_customer.setdefault(customer_email, []).append((token_no, issues_observed, device_serial_number))
+    queued = 0
+    for customer_email, tickets in by_customer.items():
+        if len(tickets) == 1:
+            token_no, issues_observed, device_serial_number = tickets[0]
+            queued += queue_rma_email(conn, customer_email, issues_observed, device_serial_number, token_no, is_closure=True)
+            continue
+        lines = "\n".join(f"#{token_no} - {issues_observed} - Device Sr No: {device_serial_number}"
+                          for token_no, issues_observed, device_serial_number in tickets)
+        subject = f"RMA Requests Closed - {len(tickets)} Tickets"
+        body = f"""
+Dear Customer,
+
+The following request tickets have been deemed closed:
+
+{lines}
+
+Best regards,
+Messung Systems Pvt. Ltd. (Ourican Automation)
+"""
+        if mailer.enqueue(conn, customer_email, subject, body):
+            logger.info(f"Closure email for {len(tickets)} tickets queued for {customer_email}")
+            queued += 1
+    return queued
 
 @app.route('/')
+@cache.cached_response
 def index():
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
+    # Full records are loaded page by page from /api/rmas
+    return render_template('index.html', search_results=[])
+
+@app.route('/api/rmas')
+@cache.cached_response
+def list_rmas():
+    args = request.args
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM rma_requests")
-            requests = c.fetchall()
-            logger.info("Fetched all RMA requests")
-        return render_template('index.html', requests=requests, search_results=[])
+        clauses, params = listing.build_filters(args)
+        cursor = args.get('cursor') or None
+        with db.get_db() as conn:
+            rows, next_cursor = listing.fetch_page(
+                conn, clauses, params,
+                sort=args.get('sort', 'id'),
+                order=args.get('order', 'asc').lower(),
+                cursor=cursor,
+                limit=args.get('limit', listing.DEFAULT_PAGE_SIZE, type=int)
+            )
+            # Total is only needed once per listing, not for every page
+            total = None if cursor else listing.count_rows(conn, clauses, params)
+        logger.debug(f"Listed {len(rows)} RMA requests")
+        return jsonify({'rmas': rows, 'next_cursor': next_cursor, 'total': total, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Error in list_rmas: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/stats')
+def rma_stats():
+    try:
+        result = stats.get_stats(db.get_db(), request.args.get('dimension') or None)
+        return jsonify({'stats': result, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Error in rma_stats: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/devices/<path:serial>/history')
+@cache.cached_response
+def device_history(serial):
+    try:
+        result = devices.get_history(db.get_db(), serial)
+        if result is None:
+            return jsonify({'message': 'Device not found', 'success': False}), 404
+        return jsonify({**result, 'success': True})
+    except sqlite3.Error as e:
+        logger.error(f"Error in device_history: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+# Without `since` the report covers the last year up to today, so cached copies expire with the date
+def _repeat_failures_window():
+    return '' if request.args.get('since') else devices.default_since()
+
+@app.route('/api/devices/repeat-failures')
+@cache.cached_response(vary=_repeat_failures_window)
+def repeat_failures():
+    args = request.args
+    try:
+        result = devices.repeat_failures(
+            db.get_db(),
+            min_rmas=args.get('min_rmas', devices.DEFAULT_MIN_RMAS, type=int),
+            since=args.get('since') or None,
+            until=args.get('until') or None,
+            limit=args.get('limit', devices.DEFAULT_REPORT_LIMIT, type=int)
+        )
+        return jsonify({**result, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Error in repeat_failures: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+# Changes after the `since` cursor as NDJSON, oldest first; pass the last seq received as the next cursor
+@app.route('/api/changes')
+def list_changes():
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', changes.DEFAULT_LIMIT)), changes.MAX_LIMIT))
+        conn = db.get_db()
+        if not changes.check_cursor(conn, since):
+            return jsonify({'message': 'Changes since this cursor have been pruned; resync from /export_excel',
+                            'success': False}), 410
+        latest = changes.latest_seq(conn)
+        chunks = changes.iter_ndjson(changes.iter_changes(conn, since, limit))
+        return Response(stream_with_context(chunks), mimetype='application/x-ndjson',
+                        headers={'X-Latest-Seq': str(latest)})
+    except ValueError:
+        return jsonify({'message': "'since' and 'limit' must be non-negative integers", 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Error in list_changes: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+# Live change events for the UI; starts at Last-Event-ID or `since`, otherwise at the newest change
+@app.route('/api/changes/stream')
+def stream_changes():
+    try:
+        conn = db.get_db()
+        cursor = request.headers.get('Last-Event-ID') or request.args.get('since')
+        since = int(cursor) if cursor else changes.latest_seq(conn)
+        if not changes.check_cursor(conn, since):
+            since = changes.latest_seq(conn)
+        return Response(stream_with_context(changes.iter_events(conn, since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except ValueError:
+        return jsonify({'message': "'since' must be a non-negative integer", 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Error in stream_changes: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+def _job_accepted(conn, job_id):
+    response = jsonify({'job': jobs.get_job(conn, job_id), 'success': True})
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+# Queue a long-running job, e.g. {"kind": "export", "params": {"format": "xlsx", "status": "Open"}};
+# poll the Location it returns. Imports upload their spreadsheet to /api/jobs/import instead.
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Body must be a JSON object', 'success': False}), 400
+    kind = data.get('kind', '')
+    params = data.get('params') or {}
+    if kind == 'import':
+        return jsonify({'message': 'Upload the spreadsheet to /api/jobs/import', 'success': False}), 400
+    if not isinstance(params, dict):
+        return jsonify({'message': "'params' must be an object", 'success': False}), 400
+    not_scalar = [name for name, value in params.items()
+                  if value is not None and not isinstance(value, (str, int, float))]
+    if not_scalar:
+        return jsonify({'message': f"Values must be strings, numbers or null: {', '.join(not_scalar)}",
+                        'success': False}), 400
+    try:
+        conn = db.get_db()
+        with conn:
+            # A null parameter is left unset rather than stored as the string 'None'
+            job_id = jobs.submit(conn, kind, {name: str(value) for name, value in params.items() if value is not None})
+        jobs.notify_runners()
+        logger.info(f"Queued {kind} job {job_id}")
+        return _job_accepted(conn, job_id)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
     except sqlite3.Error as e:
-        logger.error(f"Error fetching RMA requests: {e}")
-        return render_template('index.html', requests=[], search_results=[], error="Database error")
+        logger.error(f"Error in create_job: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+# Multipart upload (field "file", optional "sheet" and "dry_run") imported by a background job
+@app.route('/api/jobs/import', methods=['POST'])
+def create_import_job():
+    if request.content_length and request.content_length > jobs.MAX_UPLOAD_BYTES:
+        return jsonify({'message': f'Upload larger than {jobs.MAX_UPLOAD_BYTES} bytes', 'success': False}), 413
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'message': "No file uploaded in field 'file'", 'success': False}), 400
+    path = None
+    try:
+        path = jobs.save_upload(upload)
+        params = {'path': path, 'filename': upload.filename, 'sheet': request.form.get('sheet', ''),
+                  'dry_run': request.form.get('dry_run', '') in ('1', 'true', 'on')}
+        conn = db.get_db()
+        with conn:
+            job_id = jobs.submit(conn, 'import', params)
+        jobs.notify_runners()
+        logger.info(f"Queued import job {job_id} for {upload.filename}")
+        return _job_accepted(conn, job_id)
+    except (ValueError, sqlite3.Error) as e:
+        if path and os.path.exists(path):
+            os.remove(path)
+        if isinstance(e, ValueError):
+            return jsonify({'message': str(e), 'success': False}), 400
+        logger.error(f"Error in create_import_job: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/jobs')
+def list_jobs():
+    try:
+        result = jobs.list_jobs(db.get_db(), request.args.get('status') or None,
+                                request.args.get('limit', jobs.DEFAULT_LIST_LIMIT, type=int))
+        return jsonify({'jobs': result, 'success': True})
+    except sqlite3.Error as e:
+        logger.error(f"Error in list_jobs: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    try:
+        job = jobs.get_job(db.get_db(), job_id)
+        if job is None:
+            return jsonify({'message': 'Job not found', 'success': False}), 404
+        if job['status'] == 'queued':
+            # The process that queued it may have restarted; make sure some runner picks it up
+            jobs.notify_runners()
+        if job['has_result_file']:
+            job['result_url'] = url_for('job_result', job_id=job_id)
+        return jsonify({'job': job, 'success': True})
+    except sqlite3.Error as e:
+        logger.error(f"Error in job_status: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/jobs/<int:job_id>/result')
+def job_result(job_id):
+    try:
+        conn = db.get_db()
+        result = jobs.get_result_file(conn, job_id)
+        if result is None:
+            job = jobs.get_job(conn, job_id)
+            if job is None:
+                return jsonify({'message': 'Job not found', 'success': False}), 404
+            return jsonify({'message': f"Job is {job['status']} and has no result file", 'success': False}), 409
+        path, download_name, mimetype = result
+        return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True, download_name=download_name)
+    except sqlite3.Error as e:
+        logger.error(f"Error in job_result: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        status = jobs.request_cancel(db.get_db(), job_id)
+        if status is None:
+            return jsonify({'message': 'Job not found', 'success': False}), 404
+        logger.info(f"Cancellation requested for job {job_id} ({status})")
+        return jsonify({'status': status, 'success': True})
+    except sqlite3.Error as e:
+        logger.error(f"Error in cancel_job: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/submit_rma', methods=['POST'])
 def submit_rma():
     logger.debug("Received request to /submit_rma")
     try:
         data = request.form
-        logger.debug(f"Form data: {dict(data)}")
         month = data.get('month')
-        date_of_issue = data.get('date_of_issue')
+        date_of_issue = dates.to_iso(data.get('date_of_issue'))
         project = data.get('project')
         location = data.get('location')
         si_client = data.get('si_client')
         product = data.get('product')
         device_serial_number = data.get('device_serial_number')
-        delivered_material_date = data.get('delivered_material_date')
+        delivered_material_date = dates.to_iso(data.get('delivered_material_date'))
         issues_observed = data.get('issues_observed')
         emd_observation = data.get('emd_observation')
         solutions = data.get('solutions')
         replacement_dc_no = data.get('replacement_dc_no')
         tested_by_messung_engineer = data.get('tested_by_messung_engineer')
-        rma = generate_rma_token()
-        if not rma:
-            logger.error("Failed to generate RMA token")
-            return jsonify({'message': 'Failed to generate RMA token', 'success': False}), 500
         faulty_device_status = data.get('faulty_device_status')
         remark = data.get('remark')
         device_status = data.get('device_status', 'Open')  # Default to Open
@@ -160,9 +369,9 @@ def submit_rma():
         r2 = data.get('r2')
         r3 = data.get('r3')
         customer_email = data.get('customer_email')
-        token_no = rma
-        db_path = os.getenv('DATABASE_PATH', 'rma.db')
-        with sqlite3.connect(db_path, timeout=10) as conn:
+        with db.get_db() as conn:
+            # Token and row commit together, so a failed insert never burns a number
+            token_no = rma = tokens.allocate_token(conn)
             c = conn.cursor()
             c.execute('''INSERT INTO rma_requests (
                 month, date_of_issue, project, location, si_client, product, 
@@ -176,13 +385,15 @@ def submit_rma():
                        emd_observation, solutions, replacement_dc_no, tested_by_messung_engineer,
                        rma, faulty_device_status, remark, device_status, r1, r2, r3,
                        token_no, customer_email))
+            email_queued = queue_rma_email(conn, customer_email, issues_observed, device_serial_number, token_no)
             conn.commit()
             logger.debug(f"Inserted RMA: {token_no}")
-        email_sent = send_rma_email(customer_email, issues_observed, device_serial_number, token_no)
+        if email_queued:
+            mailer.notify_worker()
         return jsonify({
             'message': 'RMA request submitted successfully!',
             'token_no': token_no,
-            'email_sent': email_sent,
+            'email_queued': email_queued,
             'success': True
         })
     except sqlite3.Error as e:
@@ -194,29 +405,20 @@ def submit_rma():
 
 @app.route('/edit_rma/<token>', methods=['GET'])
 def edit_rma(token):
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM rma_requests WHERE token_no = ?", (token,))
+        with db.get_db() as conn:
+            c = db.named_cursor(conn)
+            c.execute(db.SELECT_RMA_BY_TOKEN, (token,))
             rma = c.fetchone()
         if rma:
-            rma_data = {
-                'month': rma[1], 'date_of_issue': rma[2], 'project': rma[3], 'location': rma[4],
-                'si_client': rma[5], 'product': rma[6], 'device_serial_number': rma[7],
-                'delivered_material_date': rma[8], 'issues_observed': rma[9], 'emd_observation': rma[10],
-                'solutions': rma[11], 'replacement_dc_no': rma[12], 'tested_by_messung_engineer': rma[13],
-                'rma': rma[14], 'faulty_device_status': rma[15], 'remark': rma[16], 'device_status': rma[17],
-                'r1': rma[18], 'r2': rma[19], 'r3': rma[20], 'token_no': rma[21], 'customer_email': rma[22]
-            }
             logger.debug(f"Fetched RMA for editing: {token}")
-            return render_template('index.html', requests=[], search_results=[], edit_rma=rma_data)
+            return render_template('index.html', search_results=[], edit_rma=rma)
         else:
             logger.warning(f"RMA token not found: {token}")
-            return render_template('index.html', requests=[], search_results=[], error="RMA token not found")
+            return render_template('index.html', search_results=[], error="RMA token not found")
     except sqlite3.Error as e:
         logger.error(f"Error in edit_rma: {e}")
-        return render_template('index.html', requests=[], search_results=[], error="Database error")
+        return render_template('index.html', search_results=[], error="Database error")
 
 @app.route('/update_rma/<token>', methods=['POST'])
 def update_rma(token):
@@ -224,13 +426,13 @@ def update_rma(token):
     try:
         data = request.form
         month = data.get('month')
-        date_of_issue = data.get('date_of_issue')
+        date_of_issue = dates.to_iso(data.get('date_of_issue'))
         project = data.get('project')
         location = data.get('location')
         si_client = data.get('si_client')
         product = data.get('product')
         device_serial_number = data.get('device_serial_number')
-        delivered_material_date = data.get('delivered_material_date')
+        delivered_material_date = dates.to_iso(data.get('delivered_material_date'))
         issues_observed = data.get('issues_observed')
         emd_observation = data.get('emd_observation')
         solutions = data.get('solutions')
@@ -244,8 +446,7 @@ def update_rma(token):
         r2 = data.get('r2')
         r3 = data.get('r3')
         customer_email = data.get('customer_email')
-        db_path = os.getenv('DATABASE_PATH', 'rma.db')
-        with sqlite3.connect(db_path, timeout=10) as conn:
+        with db.get_db() as conn:
             c = conn.cursor()
             c.execute('''UPDATE rma_requests SET
                 month = ?, date_of_issue = ?, project = ?, location = ?, si_client = ?, 
@@ -271,10 +472,9 @@ def update_rma(token):
 
 @app.route('/delete_rma/<token>', methods=['POST'])
 def delete_rma(token):
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
     logger.debug(f"Received request to /delete_rma/{token}")
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
+        with db.get_db() as conn:
             c = conn.cursor()
             c.execute("DELETE FROM rma_requests WHERE token_no = ?", (token,))
             conn.commit()
@@ -286,13 +486,12 @@ def delete_rma(token):
 
 @app.route('/close_rma/<token>', methods=['POST'])
 def close_rma(token):
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
     logger.debug(f"Received request to /close_rma/{token}")
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
+        with db.get_db() as conn:
             c = conn.cursor()
             # Fetch RMA details
-            c.execute("SELECT customer_email, issues_observed, device_serial_number FROM rma_requests WHERE token_no = ?", (token,))
+            c.execute(db.SELECT_RMA_FOR_EMAIL, (token,))
             rma = c.fetchone()
             if not rma:
                 logger.warning(f"RMA token not found: {token}")
@@ -300,12 +499,14 @@ def close_rma(token):
             customer_email, issues_observed, device_serial_number = rma
             # Update device_status to Closed
             c.execute("UPDATE rma_requests SET device_status = ? WHERE token_no = ?", ('Closed', token))
+            # Queue closure email
+            email_queued = queue_rma_email(conn, customer_email, issues_observed, device_serial_number, token, is_closure=True)
             conn.commit()
             logger.info(f"RMA {token} marked as Closed")
-        # Send closure email
-        email_sent = send_rma_email(customer_email, issues_observed, device_serial_number, token, is_closure=True)
+        if email_queued:
+            mailer.notify_worker()
         return jsonify({
-            'message': 'RMA closed successfully!' + (' Email sent!' if email_sent else ' Email failed.'),
+            'message': 'RMA closed successfully!' + (' Email queued!' if email_queued else ' No email queued.'),
             'success': True
         })
     except sqlite3.Error as e:
@@ -315,57 +516,108 @@ def close_rma(token):
         logger.error(f"Error in close_rma: {e}")
         return jsonify({'message': f'Server error: {str(e)}', 'success': False}), 500
 
-@app.route('/search', methods=['POST'])
+@app.route('/api/rmas/close', methods=['POST'])
+def bulk_close_rmas():
+    try:
+        token_list = bulk.parse_tokens(request.get_json(silent=True) or {})
+        with db.get_db() as conn:
+            results, closed = bulk.close_rmas(conn, token_list)
+            emails_queued = queue_closure_emails(conn, closed)
+        logger.info(f"Bulk closed {len(closed)} of {len(token_list)} RMAs")
+        if emails_queued:
+            mailer.notify_worker()
+        return jsonify({'results': results, 'closed': len(closed), 'emails_queued': emails_queued, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Database error in bulk_close_rmas: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/rmas/update', methods=['POST'])
+def bulk_update_rmas():
+    try:
+        payload = request.get_json(silent=True) or {}
+        token_list = bulk.parse_tokens(payload)
+        updates = bulk.parse_changes(payload)
+        with db.get_db() as conn:
+            results = bulk.update_rmas(conn, token_list, updates)
+        logger.info(f"Bulk updated {', '.join(updates)} on {len(token_list)} RMAs")
+        return jsonify({'results': results, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Database error in bulk_update_rmas: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/api/rmas/delete', methods=['POST'])
+def bulk_delete_rmas():
+    try:
+        token_list = bulk.parse_tokens(request.get_json(silent=True) or {})
+        with db.get_db() as conn:
+            results = bulk.delete_rmas(conn, token_list)
+        logger.info(f"Bulk deleted {len(token_list)} RMAs")
+        return jsonify({'results': results, 'success': True})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Database error in bulk_delete_rmas: {e}")
+        return jsonify({'message': f'Database error: {str(e)}', 'success': False}), 500
+
+@app.route('/search', methods=['GET', 'POST'])
+@cache.cached_response
 def search_rma():
-    search_term = request.form.get('search_term', '').strip()
-    search_type = request.form.get('search_type', 'rma')
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
+    search_term = request.values.get('search_term', '').strip()
+    search_type = request.values.get('search_type', 'rma')
     logger.debug(f"Search request: term={search_term}, type={search_type}")
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            query = ""
-            params = (f"%{search_term}%",) if search_type != 'rma' else (search_term,)
-            if search_type == 'rma':
-                query = "SELECT * FROM rma_requests WHERE rma = ?"
-            elif search_type == 'device_serial_number':
-                query = "SELECT * FROM rma_requests WHERE device_serial_number LIKE ?"
-            elif search_type == 'si_client':
-                query = "SELECT * FROM rma_requests WHERE si_client LIKE ?"
-            c.execute(query, params)
-            search_results = c.fetchall()
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM rma_requests")
-            requests = c.fetchall()
-        return render_template('index.html', requests=requests, search_results=search_results, 
+        with db.get_db() as conn:
+            search_results = search.search(conn, search_term, search_type)
+        return render_template('index.html', search_results=search_results,
                               search_term=search_term, search_type=search_type)
+    except ValueError as e:
+        return render_template('index.html', search_results=[], error=str(e))
     except sqlite3.Error as e:
         logger.error(f"Error in search_rma: {e}")
-        return render_template('index.html', requests=[], search_results=[], error="Database error")
+        return render_template('index.html', search_results=[], error="Database error")
 
 @app.route('/export_excel')
+@cache.cached_response
 def export_excel():
-    db_path = os.getenv('DATABASE_PATH', 'rma.db')
     logger.debug("Received request to /export_excel")
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in export.EXPORT_FORMATS:
+        return jsonify({'message': f'Unsupported export format: {export_format}', 'success': False}), 400
+    mimetype, download_name = export.EXPORT_FORMATS[export_format]
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            import pandas as pd
-            query = """SELECT token_no, month, date_of_issue, project, location, si_client, product, 
-                              device_serial_number AS 'Device Serial Number', delivered_material_date, issues_observed, 
-                              emd_observation, solutions, replacement_dc_no, tested_by_messung_engineer, 
-                              rma, faulty_device_status, remark, device_status, r1, r2, r3, customer_email 
-                       FROM rma_requests"""
-            df = pd.read_sql_query(query, conn)
-        excel_file = "rma_export.xlsx"
-        df.to_excel(excel_file, index=False, engine='openpyxl')
-        logger.info("Excel exported successfully")
-        return send_file(excel_file, as_attachment=True, download_name="RMA_export.xlsx")
+        query, params = export.build_query(request.args)
+        conn = db.get_db()
+        # Read before the rows, so /api/changes?since= this value can only repeat changes, never miss one
+        change_seq = str(changes.latest_seq(conn))
+        rows = export.iter_rows(conn, query, params)
+        if export_format == 'xlsx':
+            with metrics.timed(metrics.export_build_seconds, 'xlsx'):
+                fileobj = export.build_xlsx(rows)
+            logger.info("Excel exported successfully")
+            response = send_file(fileobj, mimetype=mimetype, as_attachment=True, download_name=download_name)
+            response.headers['X-Change-Seq'] = change_seq
+            return response
+        chunks = export.iter_csv(rows) if export_format == 'csv' else export.iter_ndjson(rows)
+        logger.info(f"Streaming {export_format} export")
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={download_name}',
+                                 'X-Change-Seq': change_seq})
+    except ValueError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
     except Exception as e:
         logger.error(f"Error exporting Excel: {e}")
         return jsonify({'message': f'Error exporting Excel: {str(e)}', 'success': False}), 500
 
+# Every process that serves requests checks the schema; under gunicorn the on_starting hook
+# has already migrated, so this is one PRAGMA read per worker
+init_db()
+
 if __name__ == '__main__':
-    init_db()
+    # Under gunicorn each worker starts its outbox worker in post_worker_init
+    mailer.notify_worker()
     port = int(os.getenv('PORT', 5000))  # Heroku port
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""Requests per second with concurrent readers and writers, before and after pooled WAL connections.
+
+"before" reproduces the old behaviour: a fresh rollback-journal connection for every
+database access. "after" uses db.py as shipped. Each worker is a separate process,
+like gunicorn sync workers, driving the app through the Flask test client.
+
+    python benchmarks/bench_db.py --rows 5000 --readers 4 --writers 2 --duration 10
+"""
+import os
+import sys
+import time
+import sqlite3
+import queue
+import argparse
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds past --duration to wait for a worker's result before giving up
+RESULT_GRACE = 60
+
+def _load_app(db_path, mode):
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['EMAIL_WORKER'] = 'off'
+    sys.path.insert(0, ROOT)
+    import logging
+    import db
+    if mode == 'before':
+        # Patched before app is imported, so its startup migration check uses a rollback-journal
+        # connection too instead of switching the database to WAL
+        db.get_connection = lambda: sqlite3.connect(db_path, timeout=10)
+    import app
+    logging.disable(logging.CRITICAL)
+    return app
+
+def _worker(db_path, mode, role, duration, results):
+    app = _load_app(db_path, mode)
+    client = app.app.test_client()
+    count = errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        if role == 'reader':
+            response = client.get('/api/rmas?limit=50')
+            rmas = response.json.get('rmas') if response.status_code == 200 else None
+            if rmas:
+                token = rmas[count % len(rmas)]['token_no']
+                response = client.get(f'/edit_rma/{token}')
+            elif response.status_code == 200:
+                # An empty page means the seed rows are missing; count it rather than crash
+                errors += 1
+                continue
+        else:
+            response = client.post('/submit_rma', data={
+                'month': 'MAY', 'product': 'MES-DALI-64', 'si_client': 'SI',
+                'device_serial_number': f'BENCH{os.getpid()}-{count}', 'issues_observed': 'bench'
+            })
+        if response.status_code == 200:
+            count += 1
+        else:
+            errors += 1
+    results.put((role, count, errors))
+
+def _prepare(db_path, mode, rows):
+    app = _load_app(db_path, mode)
+    app.init_db()
+    # Importing the app opened its pooled connection; close it so the journal mode can change
+    import db
+    db.close_all()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = %s" % ('DELETE' if mode == 'before' else 'WAL'))
+    conn.executemany(
+        "INSERT INTO rma_requests (month, product, si_client, device_serial_number, device_status, token_no) "
+        "VALUES (?, ?, ?, ?, 'Open', ?)",
+        ((f'M{i % 12}', f'P{i % 20}', f'C{i % 50}', f'SER{i:08d}', f'SEED-{i}') for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+def run(mode, args):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        setup = ctx.Process(target=_prepare, args=(db_path, mode, args.rows))
+        setup.start()
+        setup.join()
+        if setup.exitcode != 0:
+            sys.exit(f"{mode}: setup failed with exit code {setup.exitcode}")
+        results = ctx.Queue()
+        roles = ['reader'] * args.readers + ['writer'] * args.writers
+        procs = [ctx.Process(target=_worker, args=(db_path, mode, role, args.duration, results)) for role in roles]
+        for proc in procs:
+            proc.start()
+        totals = {'reader': [0, 0], 'writer': [0, 0]}
+        try:
+            for _ in procs:
+                role, count, errors = results.get(timeout=args.duration + RESULT_GRACE)
+                totals[role][0] += count
+                totals[role][1] += errors
+        except queue.Empty:
+            crashed = [proc.exitcode for proc in procs if proc.exitcode]
+            for proc in procs:
+                proc.terminate()
+            sys.exit(f"{mode}: timed out waiting for worker results (crashed workers' exit codes: {crashed})")
+        for proc in procs:
+            proc.join()
+        failed = [proc.exitcode for proc in procs if proc.exitcode != 0]
+        if failed:
+            sys.exit(f"{mode}: {len(failed)} workers exited with codes {failed}")
+    reads, read_errors = totals['reader']
+    writes, write_errors = totals['writer']
+    print(f"{mode:>6}: {(reads + writes) / args.duration:8.1f} req/s total | "
+          f"reads {reads / args.duration:8.1f}/s ({read_errors} errors) | "
+          f"writes {writes / args.duration:8.1f}/s ({write_errors} errors)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+    for mode in ('before', 'after'):
+        run(mode, args)
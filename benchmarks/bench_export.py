@@ -0,0 +1,86 @@
+"""Peak RSS and wall time of the Excel/CSV export at increasing table sizes.
+
+"pandas" is the old export (read_sql_query + DataFrame.to_excel); "xlsx" and "csv"
+go through /export_excel as shipped. Every measurement runs in a fresh process so
+peak RSS is not polluted by earlier runs.
+
+    python benchmarks/bench_export.py --sizes 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _seed(db_path, rows):
+    os.environ['DATABASE_PATH'] = db_path
+    sys.path.insert(0, ROOT)
+    import logging
+    import app
+    logging.disable(logging.CRITICAL)
+    app.init_db()
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO rma_requests (month, date_of_issue, project, location, si_client, product, "
+        "device_serial_number, issues_observed, device_status, token_no, customer_email) "
+        "VALUES (?, '28-05-25', ?, 'Pune', ?, ?, ?, 'Touch issue observed on site', 'Open', ?, 'client@example.com')",
+        ((f'M{i % 12}', f'Project {i % 300}', f'Client {i % 80}', f'MES-DALI-{i % 40}', f'SER{i:08d}', f'BENCH-{i}')
+         for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+def _measure(db_path, mode, results):
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['EMAIL_WORKER'] = 'off'
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    start = time.perf_counter()
+    size = 0
+    if mode == 'pandas':
+        import pandas as pd
+        with sqlite3.connect(db_path) as conn:
+            df = pd.read_sql_query("SELECT * FROM rma_requests", conn)
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as out:
+            df.to_excel(out.name, index=False, engine='openpyxl')
+            size = os.path.getsize(out.name)
+    else:
+        import app
+        client = app.app.test_client()
+        response = client.get(f'/export_excel?format={mode}', buffered=False)
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((elapsed, peak_mb, size))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--modes', nargs='+', default=['pandas', 'xlsx', 'csv'])
+    args = parser.parse_args()
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'rows':>9} {'mode':>7} {'seconds':>9} {'peak MB':>9} {'output MB':>10}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            seed = ctx.Process(target=_seed, args=(db_path, rows))
+            seed.start()
+            seed.join()
+            for mode in args.modes:
+                results = ctx.Queue()
+                proc = ctx.Process(target=_measure, args=(db_path, mode, results))
+                proc.start()
+                elapsed, peak_mb, size = results.get()
+                proc.join()
+                print(f"{rows:>9} {mode:>7} {elapsed:>9.2f} {peak_mb:>9.1f} {size / 1048576:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Concurrent-client throughput under gunicorn sync workers versus SERVING_MODE=gthread.
+
+Fast clients loop over searches and listing pages while a few slow clients keep
+requesting xlsx exports, which is what ties up sync workers in production. Both
+modes get the same number of worker processes.
+
+    python benchmarks/bench_serving.py --rows 20000 --workers 2 --threads 8 --clients 32 --duration 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+from loadtest import (ROOT, HERE, prepare_dataset, copy_dataset, sample_values, build_request, summarize,
+                      _free_port, _wait_for_port)
+
+def _fast_request(rng, i, values):
+    if i % 2:
+        return build_request('search', i, rng, values)[1]
+    return '/api/rmas?' + urlencode({'limit': 50, 'client': rng.choice(values['clients'])})
+
+def _client(port, slow, deadline, values, seed, results, keepalive):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    conn = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = build_request('export_xlsx', i, rng, values)[1] if slow else _fast_request(rng, i, values)
+        i += 1
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            # Sync workers close after every response; gthread keeps the connection open
+            if not keepalive or response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            status = None
+            if conn is not None:
+                conn.close()
+            conn = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+    if conn is not None:
+        conn.close()
+    results.append((slow, latencies, errors))
+
+def run_mode(mode, db_path, args, values):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_PATH=db_path, SERVING_MODE=mode, THREADS=str(args.threads), EMAIL_WORKER='off')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--bind', f'127.0.0.1:{port}',
+         '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port, process)
+        results = []
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=_client, args=(port, n < args.slow_clients, deadline, values,
+                                                          args.seed * 1000 + n, results, mode == 'gthread'))
+                   for n in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    report = {}
+    for name, slow in (('fast', False), ('export', True)):
+        report[name] = summarize([latency for is_slow, latencies, _ in results if is_slow == slow for latency in latencies],
+                                 sum(errors for is_slow, _, errors in results if is_slow == slow), seconds)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gthread worker')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--slow-clients', type=int, default=2, help='Clients that only request xlsx exports')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--data-dir', default=os.path.join(HERE, '.data'))
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+    source = prepare_dataset(args.rows, args.seed, args.data_dir)
+    values = sample_values(source, args.seed)
+    results = {}
+    print(f"{args.rows} rows, {args.workers} workers, {args.clients} clients ({args.slow_clients} exporting), {args.duration:.0f}s")
+    for mode in ('sync', 'gthread'):
+        db_path = os.path.join(args.data_dir, f'work-{mode}.db')
+        copy_dataset(source, db_path)
+        results[mode] = run_mode(mode, db_path, args, values)
+        fast, export = results[mode]['fast'], results[mode]['export']
+        print(f"  {mode:8} fast {fast['throughput'] or 0:8.1f} req/s  p50 {fast['p50_ms'] or 0:7.1f} ms  "
+              f"p95 {fast['p95_ms'] or 0:7.1f} ms  p99 {fast['p99_ms'] or 0:7.1f} ms  errors {fast['errors']}  "
+              f"| exports {export['requests'] - export['errors']} (p50 {export['p50_ms'] or 0:.0f} ms)")
+        os.remove(db_path)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'workers': args.workers, 'threads': args.threads, 'clients': args.clients,
+                       'slow_clients': args.slow_clients, 'duration': args.duration, 'modes': results}, f, indent=2)
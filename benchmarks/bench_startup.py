@@ -0,0 +1,81 @@
+"""Cold start of gunicorn: time to the first response, first xlsx export and a respawned worker's first response.
+
+Runs each combination of preload_app on/off and a fresh or already-migrated database.
+
+    python benchmarks/bench_startup.py --rows 10000 --runs 3
+"""
+import os
+import sys
+import time
+import signal
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+
+import dataset
+from loadtest import ROOT, _children, _free_port
+
+def _get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+# Seconds until `path` answers 200, polling from `start`
+def _time_until_ok(port, path, start, timeout=60):
+    while time.perf_counter() - start < timeout:
+        try:
+            if _get(port, path) == 200:
+                return time.perf_counter() - start
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.005)
+    raise SystemExit(f"No 200 from {path} within {timeout}s")
+
+def run_once(db_path, preload):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_PATH=db_path, PRELOAD_APP='1' if preload else '0', EMAIL_WORKER='off')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', '1', '--bind', f'127.0.0.1:{port}', 'app:app'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first = _time_until_ok(port, '/', start)
+        export_start = time.perf_counter()
+        _get(port, '/export_excel?format=xlsx&status=Open')
+        export = time.perf_counter() - export_start
+        # Kill the only worker; the next 200 comes from its replacement
+        for pid in _children(process.pid):
+            os.kill(pid, signal.SIGKILL)
+        respawn = _time_until_ok(port, '/api/rmas?limit=1', time.perf_counter())
+        return first, export, respawn
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp()
+    try:
+        migrated = os.path.join(workdir, 'migrated.db')
+        dataset.generate(migrated, args.rows)
+        print(f"{'preload':8} {'database':9} {'first response':>15} {'first xlsx':>11} {'respawn':>9}")
+        for preload in (True, False):
+            for label in ('fresh', 'migrated'):
+                timings = []
+                for run in range(args.runs):
+                    db_path = os.path.join(workdir, f'fresh-{run}-{preload}.db') if label == 'fresh' else migrated
+                    timings.append(run_once(db_path, preload))
+                first, export, respawn = (statistics.median(values) * 1000 for values in zip(*timings))
+                print(f"{'on' if preload else 'off':8} {label:9} {first:12.0f} ms {export:8.0f} ms {respawn:6.0f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,95 @@
+"""Synthetic rma_requests datasets with realistic value distributions.
+
+    python benchmarks/dataset.py bench.db --rows 100000
+"""
+import os
+import sys
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MONTHS = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+LOCATIONS = ('Pune', 'Mumbai', 'Delhi', 'Bengaluru', 'Chennai', 'Hyderabad', 'Ahmedabad', 'Kolkata', 'Nagpur', 'Goa')
+PRODUCT_FAMILIES = ('MES-DALI', 'MES-KNX', 'MES-PLC', 'MES-HMI', 'MES-IO', 'MES-PSU')
+ENGINEERS = ('Amit', 'Neha', 'Rahul', 'Sneha', 'Vikram', 'Pooja', 'Karan', 'Anjali')
+ISSUES = ('Touch issue observed', 'Display not working', 'No communication on bus', 'Device not powering on',
+          'Relay stuck', 'Firmware corrupted', 'Physical damage', 'Intermittent reset', 'Port burnt',
+          'Keypad not responding')
+SOLUTIONS = ('Replaced touch panel', 'Firmware reflashed', 'Replaced power section', 'Replaced relay',
+             'Board replaced', 'No fault found', 'Replaced with new unit', '')
+STATUSES = (('Closed', 0.7), ('Open', 0.2), ('Pending', 0.07), ('Shipped', 0.03))
+
+# Weighted choice with a Zipf-like skew: a few clients/products dominate, as in real RMA traffic
+def _zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+def generate_rows(rows, seed=0):
+    rng = random.Random(seed)
+    clients = [f'Client {i:03d}' for i in range(200)]
+    client_weights = _zipf_weights(len(clients))
+    products = [f'{family}-{model}' for family in PRODUCT_FAMILIES for model in (8, 16, 32, 64, 128, 256, 512, 1024)]
+    product_weights = _zipf_weights(len(products))
+    projects = [f'Project {i:04d}' for i in range(max(50, rows // 200))]
+    statuses, status_weights = zip(*STATUSES)
+    # Roughly 1 in 8 devices comes back more than once
+    serial_pool = max(1, int(rows * 0.88))
+    for i in range(rows):
+        month = rng.randrange(12)
+        day = rng.randint(1, 28)
+        year = rng.choice((23, 24, 25))
+        product = rng.choices(products, product_weights)[0]
+        serial_id = rng.randrange(serial_pool)
+        yield (
+            MONTHS[month], f'20{year}-{month + 1:02d}-{day:02d}', rng.choice(projects), rng.choice(LOCATIONS),
+            rng.choices(clients, client_weights)[0], product,
+            f'{product.split("-")[1]}{serial_id:07d}', f'20{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            rng.choice(ISSUES), rng.choice(('Verified on bench', 'Could not reproduce', '')), rng.choice(SOLUTIONS),
+            f'DC-{rng.randrange(100000):05d}' if rng.random() < 0.5 else '', rng.choice(ENGINEERS), '',
+            rng.choice(('Repaired', 'Scrapped', 'Pending')), '', rng.choices(statuses, status_weights)[0],
+            '', '', '', f'service{rng.randrange(500)}@example.com'
+        )
+
+COLUMNS = ('month', 'date_of_issue', 'project', 'location', 'si_client', 'product', 'device_serial_number',
+           'delivered_material_date', 'issues_observed', 'emd_observation', 'solutions', 'replacement_dc_no',
+           'tested_by_messung_engineer', 'rma', 'faulty_device_status', 'remark', 'device_status', 'r1', 'r2', 'r3',
+           'customer_email')
+
+# Create a fully migrated database at db_path holding `rows` synthetic RMAs
+def generate(db_path, rows, seed=0, chunk_size=20000):
+    os.environ['DATABASE_PATH'] = db_path
+    sys.path.insert(0, ROOT)
+    import logging
+    import app
+    import db
+    import tokens
+    logging.disable(logging.CRITICAL)
+    db.DATABASE_PATH = db_path
+    app.init_db()
+    conn = db.connect(db_path)
+    sql = (f"INSERT INTO rma_requests ({', '.join(COLUMNS)}, token_no) "
+           f"VALUES ({', '.join('?' for _ in COLUMNS)}, ?)")
+    pending = []
+    for row in generate_rows(rows, seed):
+        pending.append(row)
+        if len(pending) >= chunk_size:
+            _insert(conn, sql, pending, tokens)
+            pending = []
+    if pending:
+        _insert(conn, sql, pending, tokens)
+    conn.close()
+    logging.disable(logging.NOTSET)
+
+def _insert(conn, sql, pending, tokens):
+    with conn:
+        block = tokens.reserve_tokens(conn, len(pending))
+        conn.executemany(sql, [row[:13] + (token,) + row[14:] + (token,) for row, token in zip(pending, block)])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, args.rows, args.seed)
+    print(f"Generated {args.rows} rows in {args.path}")
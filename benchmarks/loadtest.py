@@ -0,0 +1,384 @@
+"""Load test of the main routes against a synthetic dataset; writes JSON results for comparison across commits.
+
+Each driver runs in its own process against a fresh copy of a cached dataset
+(benchmarks/.data/rma-<rows>-<seed>.db). "flask" drives the app in-process through
+the test client; "gunicorn" starts a local gunicorn and drives it over HTTP. Mail
+goes to a stub SMTP server, so the outbox worker runs as it would in production.
+
+    python benchmarks/loadtest.py --rows 100000 --driver flask gunicorn --concurrency 8
+    python benchmarks/loadtest.py --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import http.client
+import multiprocessing
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+import dataset
+from smtp_stub import StubSMTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('listing', 'search', 'submit', 'update', 'close', 'export_csv', 'export_xlsx')
+# Exports are orders of magnitude slower than the other routes, so they get fewer requests
+EXPORT_SCENARIOS = ('export_csv', 'export_xlsx')
+SEARCH_TYPES = ('rma', 'device_serial_number', 'si_client', 'all')
+# /api/rmas views the listing scenario pages through: (sort, order, filters); a 'client'
+# filter of None is filled with sampled clients
+LISTING_VIEWS = (
+    ('id', 'asc', {}),
+    ('date_of_issue', 'desc', {}),
+    ('product', 'asc', {}),
+    ('si_client', 'asc', {'status': 'Closed'}),
+    ('token_no', 'desc', {'status': 'Open'}),
+    ('date_of_issue', 'asc', {'client': None}),
+)
+# Pages walked per view, so requests mix first pages with cursor follow-ups
+LISTING_PAGES = 20
+
+# Build (once) and return the cached dataset for rows/seed
+def prepare_dataset(rows, seed, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'rma-{rows}-{seed}.db')
+    if not os.path.exists(path):
+        print(f"Generating {rows} rows into {path}...")
+        start = time.perf_counter()
+        process = multiprocessing.get_context('spawn').Process(target=dataset.generate, args=(path + '.tmp', rows, seed))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise SystemExit(f"Dataset generation failed with exit code {process.exitcode}")
+        os.replace(path + '.tmp', path)
+        print(f"Generated in {time.perf_counter() - start:.1f}s")
+    return path
+
+# Fresh working copy, since the write scenarios change the data
+def copy_dataset(source, target):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    conn = sqlite3.connect(target)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+# Values the scenarios draw their parameters from
+def sample_values(db_path, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    token_list = [row[0] for row in conn.execute("SELECT token_no FROM rma_requests")]
+    serials = [row[0] for row in conn.execute(
+        "SELECT device_serial_number FROM rma_requests WHERE id IN (SELECT id FROM rma_requests ORDER BY random() LIMIT 500)")]
+    clients = [row[0] for row in conn.execute("SELECT DISTINCT si_client FROM rma_requests LIMIT 500")]
+    pages = listing_pages(conn, rng, clients)
+    conn.close()
+    rng.shuffle(token_list)
+    return {'tokens': token_list, 'serials': serials, 'clients': clients, 'pages': pages}
+
+# /api/rmas URLs for the first LISTING_PAGES pages of each view, cursors included, in random order
+def listing_pages(conn, rng, clients):
+    sys.path.insert(0, ROOT)
+    import listing
+    pages = []
+    for sort, order, filters in LISTING_VIEWS:
+        for client in rng.sample(clients, min(5, len(clients))) if 'client' in filters else [None]:
+            query = dict(filters, client=client) if client else dict(filters)
+            clauses, params = listing.build_filters(query)
+            cursor = None
+            for _ in range(LISTING_PAGES):
+                page_query = dict(query, sort=sort, order=order, limit=listing.DEFAULT_PAGE_SIZE)
+                if cursor:
+                    page_query['cursor'] = cursor
+                pages.append('/api/rmas?' + urlencode(page_query))
+                _, cursor = listing.fetch_page(conn, clauses, params, sort, order, cursor)
+                if not cursor:
+                    break
+    rng.shuffle(pages)
+    return pages
+
+def _form(rng):
+    row = next(dataset.generate_rows(1, rng.randrange(1 << 30)))
+    return dict(zip(dataset.COLUMNS, row))
+
+# (method, path, form data) for request number i of a scenario
+def build_request(scenario, i, rng, values):
+    if scenario == 'listing':
+        return 'GET', values['pages'][i % len(values['pages'])], None
+    if scenario == 'search':
+        search_type = SEARCH_TYPES[i % len(SEARCH_TYPES)]
+        if search_type == 'rma':
+            term = rng.choice(values['tokens'])
+        elif search_type == 'si_client':
+            term = rng.choice(values['clients'])
+        elif search_type == 'all':
+            term = rng.choice(dataset.ISSUES).split()[0]
+        else:
+            term = rng.choice(values['serials'])
+        return 'GET', '/search?' + urlencode({'search_term': term, 'search_type': search_type}), None
+    if scenario == 'submit':
+        return 'POST', '/submit_rma', _form(rng)
+    if scenario == 'update':
+        form = _form(rng)
+        token = values['tokens'][i % len(values['tokens'])]
+        form['rma'] = token
+        return 'POST', f'/update_rma/{token}', form
+    if scenario == 'close':
+        # Walk the shuffled tokens from the end so close and update touch different rows
+        return 'POST', f"/close_rma/{values['tokens'][-1 - i % len(values['tokens'])]}", None
+    if scenario in EXPORT_SCENARIOS:
+        export_format = scenario.split('_')[1]
+        return 'GET', '/export_excel?' + urlencode({'format': export_format, 'client': rng.choice(values['clients'])}), None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 2) if seconds else None,
+        'mean_ms': ms(statistics.fmean(ordered)) if ordered else None,
+        'p50_ms': ms(_percentile(ordered, 0.50)),
+        'p95_ms': ms(_percentile(ordered, 0.95)),
+        'p99_ms': ms(_percentile(ordered, 0.99)),
+        'max_ms': ms(ordered[-1]) if ordered else None,
+    }
+
+# Fire `count` requests from `concurrency` threads; send(method, path, data) returns the status code
+def run_scenario(scenario, count, concurrency, values, seed, make_sender):
+    def work(worker):
+        rng = random.Random(seed * 1000 + worker)
+        send = make_sender()
+        latencies, errors = [], 0
+        for i in range(worker, count, concurrency):
+            method, path, data = build_request(scenario, i, rng, values)
+            start = time.perf_counter()
+            try:
+                status = send(method, path, data)
+            except (OSError, http.client.HTTPException):
+                status = None
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(work, range(concurrency)))
+    seconds = time.perf_counter() - start
+    return summarize([latency for latencies, _ in outcomes for latency in latencies],
+                     sum(errors for _, errors in outcomes), seconds)
+
+def _counts(args):
+    return {scenario: args.export_requests if scenario in EXPORT_SCENARIOS else args.requests
+            for scenario in args.scenarios}
+
+def _flask_driver(db_path, env, args, values, results):
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import logging
+    import app
+    logging.disable(logging.CRITICAL)
+
+    def make_sender():
+        client = app.app.test_client()
+
+        def send(method, path, data):
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            response.close()
+            return response.status_code
+        return send
+
+    report = {}
+    for scenario, count in _counts(args).items():
+        run_scenario(scenario, args.warmup, args.concurrency, values, args.seed + 1, make_sender)
+        report[scenario] = run_scenario(scenario, count, args.concurrency, values, args.seed, make_sender)
+        report[scenario]['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put(report)
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return children
+
+# Peak RSS (VmHWM) of the largest gunicorn process, master or worker; None off Linux
+def _gunicorn_peak_rss(master_pid):
+    peak = None
+    for pid in [master_pid] + _children(master_pid):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak or 0, int(line.split()[1]))
+        except OSError:
+            continue
+    return peak
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("gunicorn did not start")
+
+def _gunicorn_driver(db_path, env, args, values):
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--bind', f'127.0.0.1:{port}',
+         '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=dict(os.environ, **env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port, process)
+
+        def make_sender():
+            def send(method, path, data):
+                # Sync workers close the connection after every response
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                try:
+                    body = urlencode(data) if data is not None else None
+                    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data is not None else {}
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    return response.status
+                finally:
+                    conn.close()
+            return send
+
+        report = {}
+        for scenario, count in _counts(args).items():
+            run_scenario(scenario, args.warmup, args.concurrency, values, args.seed + 1, make_sender)
+            report[scenario] = run_scenario(scenario, count, args.concurrency, values, args.seed, make_sender)
+            report[scenario]['peak_rss_kb'] = _gunicorn_peak_rss(process.pid)
+        return report
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def _git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+def run(args):
+    source = prepare_dataset(args.rows, args.seed, args.data_dir)
+    values = sample_values(source, args.seed)
+    smtp = StubSMTPServer().start()
+    commit, dirty = _git_revision()
+    os.makedirs(args.output, exist_ok=True)
+    for driver in args.driver:
+        db_path = os.path.join(args.data_dir, f'work-{driver}.db')
+        copy_dataset(source, db_path)
+        env = {'DATABASE_PATH': db_path, 'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': str(smtp.port),
+               'SMTP_STARTTLS': '0', 'SMTP_PASSWORD': '', 'EMAIL_WORKER': 'thread'}
+        sent_before = smtp.messages
+        print(f"{driver}: {args.rows} rows, concurrency {args.concurrency}"
+              + (f", {args.workers} workers" if driver == 'gunicorn' else ''))
+        if driver == 'flask':
+            results = multiprocessing.get_context('spawn').Queue()
+            process = multiprocessing.get_context('spawn').Process(
+                target=_flask_driver, args=(db_path, env, args, values, results))
+            process.start()
+            report = results.get()
+            process.join()
+        else:
+            report = _gunicorn_driver(db_path, env, args, values)
+        result = {
+            'commit': commit, 'dirty': dirty, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'driver': driver, 'rows': args.rows, 'seed': args.seed, 'concurrency': args.concurrency, 'warmup': args.warmup,
+            'workers': args.workers if driver == 'gunicorn' else 1,
+            'smtp_messages': smtp.messages - sent_before, 'scenarios': report,
+        }
+        for scenario, stats in report.items():
+            print(f"  {scenario:12} {stats['throughput'] or 0:9.1f} req/s  p50 {stats['p50_ms'] or 0:8.1f} ms  "
+                  f"p95 {stats['p95_ms'] or 0:8.1f} ms  p99 {stats['p99_ms'] or 0:8.1f} ms  "
+                  f"errors {stats['errors']}  peak {(stats['peak_rss_kb'] or 0) / 1024:.0f} MB")
+        path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{(commit or 'nogit')[:8]}-{driver}-{args.rows}.json")
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"  wrote {path}")
+        os.remove(db_path)
+
+# Print per-scenario changes between two result files; exit 1 when p95 regresses past the threshold
+def compare(base_path, new_path, threshold):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{(base['commit'] or '?')[:8]} -> {(new['commit'] or '?')[:8]} ({new['driver']}, {new['rows']} rows)")
+    regressions = []
+    for scenario, stats in new['scenarios'].items():
+        old = base['scenarios'].get(scenario)
+        if not old or not old['p95_ms'] or not stats['p95_ms']:
+            continue
+        throughput = (stats['throughput'] / old['throughput'] - 1) * 100 if old['throughput'] else 0
+        p95 = (stats['p95_ms'] / old['p95_ms'] - 1) * 100
+        print(f"  {scenario:12} throughput {throughput:+7.1f}%  p95 {old['p95_ms']:8.1f} -> {stats['p95_ms']:8.1f} ms ({p95:+.1f}%)")
+        if p95 > threshold:
+            regressions.append(scenario)
+    if regressions:
+        print(f"p95 regressed by more than {threshold}%: {', '.join(regressions)}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--driver', nargs='+', choices=('flask', 'gunicorn'), default=['flask'])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--export-requests', type=int, default=10, help='Requests per export scenario')
+    parser.add_argument('--warmup', type=int, default=4, help='Unmeasured requests before each scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, '.data'))
+    parser.add_argument('--output', default=os.path.join(HERE, 'results'))
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=20, help='Allowed p95 regression in percent')
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    run(args)
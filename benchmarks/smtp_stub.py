@@ -0,0 +1,67 @@
+"""Minimal SMTP sink for benchmarks: accepts every message and counts it.
+
+    python benchmarks/smtp_stub.py --port 8025
+
+Point the app at it with SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=0 SMTP_PASSWORD=
+"""
+import argparse
+import threading
+import socketserver
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self._reply('220 localhost stub ESMTP')
+        for raw in self.rfile:
+            command = raw.decode('utf-8', 'replace').strip().split(' ', 1)[0].upper()
+            if command in ('HELO', 'EHLO'):
+                self._reply('250 localhost')
+            elif command == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                self.server.count_message()
+                self._reply('250 OK')
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP and anything else
+                self._reply('250 OK')
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+    # Serve from a daemon thread; returns self for `server = StubSMTPServer().start()`
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+    server = StubSMTPServer(args.host, args.port)
+    print(f"Stub SMTP listening on {args.host}:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{server.messages} messages received")
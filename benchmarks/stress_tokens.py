@@ -0,0 +1,78 @@
+"""Multi-process stress check for the RMA token allocator.
+
+Several processes insert rows concurrently, mixing single tokens, reserved blocks
+and transactions that roll back. Afterwards every committed token must be unique
+and the committed sequence numbers must form one gap-free range. Exits non-zero
+on failure.
+
+    python benchmarks/stress_tokens.py --processes 8 --iterations 300
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import tokens
+
+def _worker(db_path, iterations, seed):
+    rng = random.Random(seed)
+    conn = db.connect(db_path)
+    for i in range(iterations):
+        count = 1 if rng.random() < 0.7 else rng.randint(2, 20)
+        with conn:
+            block = tokens.reserve_tokens(conn, count)
+            conn.executemany("INSERT INTO rma_requests (token_no, device_serial_number) VALUES (?, ?)",
+                             ((token, f'STRESS-{seed}-{i}') for token in block))
+            if rng.random() < 0.1:
+                # Abandoned transaction: its numbers must be handed out again, not lost
+                conn.rollback()
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'stress.db')
+        conn = db.connect(db_path)
+        with conn:
+            conn.execute("CREATE TABLE rma_requests (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "token_no TEXT UNIQUE, device_serial_number TEXT)")
+            tokens.init_sequence(conn.cursor())
+        procs = [multiprocessing.Process(target=_worker, args=(db_path, args.iterations, seed))
+                 for seed in range(args.processes)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        failed_workers = [proc.exitcode for proc in procs if proc.exitcode != 0]
+        issued = [row[0] for row in conn.execute("SELECT token_no FROM rma_requests")]
+        last_sequence = conn.execute("SELECT last_sequence FROM rma_sequence WHERE id = 1").fetchone()[0]
+        conn.close()
+    numbers = sorted(int(token[len(tokens.TOKEN_PREFIX):]) for token in issued)
+    expected = list(range(tokens.INITIAL_SEQUENCE + 1, last_sequence + 1))
+    print(f"{len(issued)} tokens committed by {args.processes} processes, last sequence {last_sequence}")
+    ok = True
+    if failed_workers:
+        print(f"FAIL: {len(failed_workers)} workers exited with errors")
+        ok = False
+    if len(set(issued)) != len(issued):
+        print("FAIL: duplicate tokens")
+        ok = False
+    if numbers != expected:
+        missing = sorted(set(expected) - set(numbers))
+        print(f"FAIL: sequence has gaps, {len(missing)} missing (first: {missing[:10]})")
+        ok = False
+    if ok:
+        print("OK: tokens are unique and gap-free")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import dates
+import listing
+
+# Columns a bulk update may change; identity columns stay fixed
+UPDATABLE_COLUMNS = tuple(column for column in listing.RMA_COLUMNS if column not in ('id', 'token_no'))
+MAX_BATCH_SIZE = 1000
+# Stay under SQLite's bound-parameter limit in IN (...) lookups
+LOOKUP_BATCH_SIZE = 900
+
+# A valid JSON body can still be a list or a bare value
+def _check_object(payload):
+    if not isinstance(payload, dict):
+        raise ValueError("Body must be a JSON object")
+
+# Validate the token list from a JSON payload; duplicates are dropped, order kept
+def parse_tokens(payload):
+    _check_object(payload)
+    token_list = payload.get('tokens')
+    if not isinstance(token_list, list) or not token_list:
+        raise ValueError("'tokens' must be a non-empty list")
+    if not all(isinstance(token, str) and token for token in token_list):
+        raise ValueError("Every token must be a non-empty string")
+    token_list = list(dict.fromkeys(token_list))
+    if len(token_list) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} tokens per request")
+    return token_list
+
+def parse_changes(payload):
+    _check_object(payload)
+    changes = payload.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("'changes' must be a non-empty object")
+    invalid = [column for column in changes if column not in UPDATABLE_COLUMNS]
+    if invalid:
+        raise ValueError(f"Cannot update: {', '.join(invalid)}")
+    not_scalar = [column for column, value in changes.items()
+                  if value is not None and not isinstance(value, (str, int, float))]
+    if not_scalar:
+        raise ValueError(f"Values must be strings, numbers or null: {', '.join(not_scalar)}")
+    return dates.normalize_dates(changes)
+
+# token -> selected columns for the tokens that exist
+def fetch_existing(conn, token_list, columns):
+    found = {}
+    c = conn.cursor()
+    for i in range(0, len(token_list), LOOKUP_BATCH_SIZE):
+        batch = token_list[i:i + LOOKUP_BATCH_SIZE]
+        c.execute(f"SELECT token_no, {', '.join(columns)} FROM rma_requests "
+                  f"WHERE token_no IN ({', '.join('?' for _ in batch)})", batch)
+        for row in c.fetchall():
+            found[row[0]] = row[1:]
+    return found
+
+# Close open RMAs; returns per-token results and (token, email, issues, serial) for each newly closed one
+def close_rmas(conn, token_list):
+    found = fetch_existing(conn, token_list, ('customer_email', 'issues_observed', 'device_serial_number', 'device_status'))
+    to_close = [token for token in token_list if token in found and found[token][3] != 'Closed']
+    conn.executemany("UPDATE rma_requests SET device_status = 'Closed' WHERE token_no = ?",
+                     [(token,) for token in to_close])
+    results = []
+    for token in token_list:
+        if token not in found:
+            status = 'not_found'
+        elif found[token][3] == 'Closed':
+            status = 'already_closed'
+        else:
+            status = 'closed'
+        results.append({'token_no': token, 'status': status})
+    closed = [(token,) + found[token][:3] for token in to_close]
+    return results, closed
+
+def update_rmas(conn, token_list, changes):
+    found = fetch_existing(conn, token_list, ('id',))
+    columns = list(changes)
+    values = [changes[column] for column in columns]
+    conn.executemany(f"UPDATE rma_requests SET {', '.join(f'{column} = ?' for column in columns)} WHERE token_no = ?",
+                     [values + [token] for token in token_list if token in found])
+    return [{'token_no': token, 'status': 'updated' if token in found else 'not_found'} for token in token_list]
+
+def delete_rmas(conn, token_list):
+    found = fetch_existing(conn, token_list, ('id',))
+    conn.executemany("DELETE FROM rma_requests WHERE token_no = ?", [(token,) for token in token_list if token in found])
+    return [{'token_no': token, 'status': 'deleted' if token in found else 'not_found'} for token in token_list]
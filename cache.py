@@ -0,0 +1,105 @@
+import os
+import hashlib
+import threading
+from urllib.parse import urlencode
+from functools import wraps
+from collections import OrderedDict
+from flask import request, make_response
+import db
+
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+
+# Least-recently-used cache bounded by total body size and entry count
+class LRUCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, body, mimetype):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, mimetype)
+            self.size += size
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+page_cache = LRUCache()
+
+# Version counter bumped by triggers on every write to rma_requests
+def init_version(c):
+    c.execute("INSERT OR IGNORE INTO rma_counters (name, value) VALUES ('version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_version_{event.lower()} AFTER {event} ON rma_requests
+                      BEGIN
+                          UPDATE rma_counters SET value = value + 1 WHERE name = 'version';
+                      END''')
+
+def get_version(conn):
+    result = conn.execute("SELECT value FROM rma_counters WHERE name = 'version'").fetchone()
+    return result[0] if result else 0
+
+# Identity of a response: route plus its sorted query/form arguments
+def _request_key():
+    args = sorted(request.values.items(multi=True))
+    return request.path + '?' + urlencode(args)
+
+# ETag + If-None-Match for a read view, and an LRU of rendered bodies keyed on the table version.
+# Streamed and file responses get the ETag but are not stored. `vary` returns anything else the
+# response depends on, e.g. a default date window, and becomes part of the key:
+# @cached_response(vary=lambda: ...)
+def cached_response(view=None, vary=None):
+    if view is None:
+        return lambda view: cached_response(view, vary)
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = get_version(db.get_db())
+        key = _request_key()
+        if vary:
+            key += '#' + vary()
+        etag = f"{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            entry = page_cache.get((version, key))
+            if entry is not None:
+                body, mimetype = entry
+                response = make_response(body)
+                response.mimetype = mimetype
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not response.is_streamed and not response.direct_passthrough:
+                    page_cache.set((version, key), response.get_data(), response.mimetype)
+        response.set_etag(etag, weak=True)
+        # Browsers must revalidate, which is a cheap 304 while nothing has changed
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import logging
+import db
+import listing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 10000
+MAX_LIMIT = 100000
+FETCH_CHUNK_SIZE = 1000
+# Server-Sent Events: how often to poll for new changes, how often to send a keep-alive comment,
+# and how long one stream lasts before the browser reconnects with Last-Event-ID. Every open
+# stream holds a worker thread, so run with SERVING_MODE=gthread before enabling LIVE_UPDATES.
+STREAM_POLL_INTERVAL = float(os.getenv('CHANGE_STREAM_POLL_INTERVAL', 1))
+STREAM_HEARTBEAT = 15
+STREAM_MAX_SECONDS = float(os.getenv('CHANGE_STREAM_MAX_SECONDS', 300))
+LIVE_UPDATES = os.getenv('LIVE_UPDATES', '0') == '1'
+
+def _row_json(prefix):
+    return "json_object(" + ", ".join(f"'{column}', {prefix}{column}" for column in listing.RMA_COLUMNS) + ")"
+
+_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+# Append-only log of every write to rma_requests. seq is AUTOINCREMENT, so it never goes
+# backwards or gets reused, and SQLite's single writer commits entries in seq order.
+def init_changes(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS rma_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    changed_at TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    rma_id INTEGER NOT NULL,
+                    token_no TEXT,
+                    data TEXT
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_changes_changed_at ON rma_changes (changed_at)")
+    # Highest seq removed by prune(); cursors older than this must resync from an export
+    c.execute("INSERT OR IGNORE INTO rma_counters (name, value) VALUES ('changes_pruned', 0)")
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_changes_insert AFTER INSERT ON rma_requests
+                  BEGIN
+                      INSERT INTO rma_changes (changed_at, operation, rma_id, token_no, data)
+                      VALUES ({_NOW}, 'insert', new.id, new.token_no, {_row_json('new.')});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_changes_update AFTER UPDATE ON rma_requests
+                  BEGIN
+                      INSERT INTO rma_changes (changed_at, operation, rma_id, token_no, data)
+                      VALUES ({_NOW},
+                              CASE WHEN new.device_status = 'Closed' AND old.device_status IS NOT 'Closed'
+                                   THEN 'close' ELSE 'update' END,
+                              new.id, new.token_no, {_row_json('new.')});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_changes_delete AFTER DELETE ON rma_requests
+                  BEGIN
+                      INSERT INTO rma_changes (changed_at, operation, rma_id, token_no, data)
+                      VALUES ({_NOW}, 'delete', old.id, old.token_no, NULL);
+                  END''')
+
+# Sequence number of the newest change; an export taken now is current as of this cursor
+def latest_seq(conn):
+    result = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rma_changes'").fetchone()
+    return result[0] if result else 0
+
+def check_cursor(conn, since):
+    if since < 0:
+        raise ValueError("'since' must be a non-negative sequence number")
+    result = conn.execute("SELECT value FROM rma_counters WHERE name = 'changes_pruned'").fetchone()
+    pruned = result[0] if result else 0
+    return since >= pruned
+
+# Yield (seq, operation, token_no, changed_at, data JSON text) after `since`, oldest first
+def iter_changes(conn, since, limit=DEFAULT_LIMIT):
+    c = conn.cursor()
+    c.execute("SELECT seq, operation, token_no, changed_at, data FROM rma_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+              (since, limit))
+    while True:
+        rows = c.fetchmany(FETCH_CHUNK_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+# The row JSON is stored already serialised, so it is spliced into each line as is
+def _line(seq, operation, token_no, changed_at, data):
+    return (f'{{"seq":{seq},"op":"{operation}","token_no":{json.dumps(token_no)},'
+            f'"changed_at":"{changed_at}","data":{data or "null"}}}')
+
+def iter_ndjson(changes, chunk_size=FETCH_CHUNK_SIZE):
+    lines = []
+    for change in changes:
+        lines.append(_line(*change) + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+# Server-Sent Events: one event per change (id = seq, so reconnects resume via Last-Event-ID)
+def iter_events(conn, since, max_seconds=STREAM_MAX_SECONDS):
+    yield f"retry: {int(STREAM_POLL_INTERVAL * 2000)}\n\n"
+    start = last_sent = time.monotonic()
+    while time.monotonic() - start < max_seconds:
+        events = []
+        for change in iter_changes(conn, since, FETCH_CHUNK_SIZE):
+            since = change[0]
+            events.append(f"id: {change[0]}\nevent: {change[1]}\ndata: {_line(*change)}\n\n")
+        if events:
+            last_sent = time.monotonic()
+            yield "".join(events)
+        elif time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        else:
+            time.sleep(STREAM_POLL_INTERVAL)
+
+# Drop changes older than `days`; returns how many were removed
+def prune(conn, days):
+    cutoff = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() - days * 86400))
+    with conn:
+        result = conn.execute("SELECT MAX(seq) FROM rma_changes WHERE changed_at < ?", (cutoff,)).fetchone()
+        if result[0] is None:
+            return 0
+        deleted = conn.execute("DELETE FROM rma_changes WHERE seq <= ?", (result[0],)).rowcount
+        conn.execute("UPDATE rma_counters SET value = MAX(value, ?) WHERE name = 'changes_pruned'", (result[0],))
+    logger.info(f"Pruned {deleted} changes up to seq {result[0]}")
+    return deleted
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) == 3 and sys.argv[1] == 'prune':
+        print(f"Pruned {prune(db.get_connection(), float(sys.argv[2]))} changes")
+    else:
+        print("Usage: python changes.py prune DAYS")
+        sys.exit(2)
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+# rma_requests columns stored as ISO 8601 (YYYY-MM-DD), so they sort and range-filter on an index
+DATE_COLUMNS = ('date_of_issue', 'delivered_material_date')
+
+# ISO first, then the dd-mm-yy form the app used to store and the spreadsheets still use
+_INPUT_FORMATS = ('%Y-%m-%d', '%d-%m-%y', '%d-%m-%Y', '%d/%m/%y', '%d/%m/%Y', '%d.%m.%y', '%d.%m.%Y')
+
+# ISO date for a user-entered value; raises ValueError when it is not a recognised date
+def parse_date(value):
+    text = str(value).strip()
+    for fmt in _INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {value}")
+
+# Lenient form for stored data: unrecognised values are kept as entered rather than lost
+def to_iso(value):
+    if value is None or not str(value).strip():
+        return value
+    try:
+        return parse_date(value)
+    except ValueError:
+        return value
+
+# Copy of a column -> value mapping with its date columns converted to ISO
+def normalize_dates(values):
+    return {column: to_iso(value) if column in DATE_COLUMNS else value for column, value in values.items()}
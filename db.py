@@ -0,0 +1,87 @@
+import os
+import atexit
+import sqlite3
+import logging
+import threading
+from flask import g
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Read once per process instead of on every request
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'rma.db')
+
+# Applied to every new connection; WAL lets readers proceed while a writer commits
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Prepared statements stay cached per connection, so reused connections skip re-parsing hot queries
+STATEMENT_CACHE_SIZE = 256
+
+# Hot queries shared by the routes; identical SQL text hits the statement cache
+SELECT_RMA_BY_TOKEN = "SELECT * FROM rma_requests WHERE token_no = ?"
+SELECT_RMA_FOR_EMAIL = "SELECT customer_email, issues_observed, device_serial_number FROM rma_requests WHERE token_no = ?"
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Open a new tuned connection
+def connect(path=None):
+    conn = sqlite3.connect(path or DATABASE_PATH, timeout=10, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=metrics.InstrumentedConnection)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Connection reused by the current thread; reopened after a fork so workers never share one
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        with _connections_lock:
+            _connections.append((os.getpid(), conn))
+        logger.debug(f"Opened database connection for thread {threading.get_ident()}")
+    return conn
+
+# Cursor returning sqlite3.Row, so callers read columns by name instead of position
+def named_cursor(conn):
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    return c
+
+# Connection for the current Flask app context
+def get_db():
+    if 'db' not in g:
+        g.db = get_connection()
+    return g.db
+
+# Return the connection to its thread without leaving a transaction open
+def release_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Close every connection this process opened; runs on worker shutdown
+def close_all():
+    with _connections_lock:
+        connections = [conn for pid, conn in _connections if pid == os.getpid()]
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error closing database connection: {e}")
+    _local.conn = None
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+atexit.register(close_all)
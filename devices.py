@@ -0,0 +1,150 @@
+import sys
+import logging
+from datetime import date, timedelta
+import db
+import dates
+
+logger = logging.getLogger(__name__)
+
+# Columns of a device's RMA timeline, oldest first
+HISTORY_COLUMNS = (
+    'token_no', 'date_of_issue', 'delivered_material_date', 'si_client', 'product', 'project', 'location',
+    'issues_observed', 'emd_observation', 'solutions', 'faulty_device_status', 'device_status', 'remark'
+)
+DEFAULT_MIN_RMAS = 2
+DEFAULT_WINDOW_DAYS = 365
+DEFAULT_REPORT_LIMIT = 100
+MAX_REPORT_LIMIT = 1000
+
+# Recompute one serial's summary row from its RMAs; the serial index makes this a few row reads
+def _refresh_sql(serial):
+    return f'''DELETE FROM devices WHERE serial = {serial};
+               INSERT INTO devices (serial, rma_count, first_issue, last_issue, last_token, product, si_client, last_status)
+                   SELECT r.device_serial_number, COUNT(*), MIN(r.date_of_issue), MAX(r.date_of_issue),
+                          latest.token_no, latest.product, latest.si_client, latest.device_status
+                   FROM rma_requests r,
+                        (SELECT token_no, product, si_client, device_status FROM rma_requests
+                         WHERE device_serial_number = {serial} ORDER BY id DESC LIMIT 1) AS latest
+                   WHERE r.device_serial_number = {serial} AND {serial} <> ''
+                   GROUP BY r.device_serial_number;'''
+
+# Create the per-device summary table, the serial -> RMA index and the triggers that keep both current
+def init_devices(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'devices'")
+    exists = c.fetchone() is not None
+    c.execute('''CREATE TABLE IF NOT EXISTS devices (
+                    serial TEXT PRIMARY KEY,
+                    rma_count INTEGER NOT NULL,
+                    first_issue TEXT,
+                    last_issue TEXT,
+                    last_token TEXT,
+                    product TEXT,
+                    si_client TEXT,
+                    last_status TEXT
+                ) WITHOUT ROWID''')
+    # Narrows the repeat-failure candidates for higher thresholds
+    c.execute("CREATE INDEX IF NOT EXISTS idx_devices_rma_count ON devices (rma_count)")
+    # (serial, date, id) order serves history timelines and windowed counts without sorting;
+    # it also covers the exact serial lookups the single-column index used to serve
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_serial_date ON rma_requests (device_serial_number, date_of_issue)")
+    c.execute("DROP INDEX IF EXISTS idx_rma_device_serial_number")
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS devices_insert AFTER INSERT ON rma_requests
+                  BEGIN
+                      {_refresh_sql('new.device_serial_number')}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS devices_delete AFTER DELETE ON rma_requests
+                  BEGIN
+                      {_refresh_sql('old.device_serial_number')}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS devices_update
+                  AFTER UPDATE OF device_serial_number, date_of_issue, token_no, product, si_client, device_status
+                  ON rma_requests
+                  BEGIN
+                      {_refresh_sql('old.device_serial_number')}
+                      {_refresh_sql('new.device_serial_number')}
+                  END''')
+    if not exists:
+        rebuild(c)
+
+_SCAN_SQL = '''SELECT r.device_serial_number, COUNT(*), MIN(r.date_of_issue), MAX(r.date_of_issue),
+                      latest.token_no, latest.product, latest.si_client, latest.device_status
+               FROM rma_requests r
+               JOIN rma_requests latest ON latest.id = (SELECT MAX(id) FROM rma_requests
+                                                         WHERE device_serial_number = r.device_serial_number)
+               WHERE r.device_serial_number <> ''
+               GROUP BY r.device_serial_number'''
+
+# Recompute every device row from a full scan of rma_requests
+def rebuild(c):
+    c.execute("DELETE FROM devices")
+    c.execute(f'''INSERT INTO devices (serial, rma_count, first_issue, last_issue, last_token, product, si_client, last_status)
+                  {_SCAN_SQL}''')
+    logger.info("Rebuilt device index")
+
+# Compare the device rows with a full scan; returns the serials that disagree
+def check(c):
+    c.execute(_SCAN_SQL)
+    expected = {row[0]: tuple(row[1:]) for row in c.fetchall()}
+    c.execute("SELECT serial, rma_count, first_issue, last_issue, last_token, product, si_client, last_status FROM devices")
+    actual = {row[0]: tuple(row[1:]) for row in c.fetchall()}
+    return [{'serial': serial, 'expected': expected.get(serial), 'actual': actual.get(serial)}
+            for serial in sorted(expected.keys() | actual.keys()) if expected.get(serial) != actual.get(serial)]
+
+_DEVICE_COLUMNS = ('serial', 'rma_count', 'first_issue', 'last_issue', 'last_token', 'product', 'si_client', 'last_status')
+
+# Summary and RMA timeline for one serial, or None if it has never been returned
+def get_history(conn, serial):
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(_DEVICE_COLUMNS)} FROM devices WHERE serial = ?", (serial,))
+    device = c.fetchone()
+    if device is None:
+        return None
+    c.execute(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM rma_requests "
+              f"WHERE device_serial_number = ? ORDER BY date_of_issue, id", (serial,))
+    history = [dict(zip(HISTORY_COLUMNS, row)) for row in c.fetchall()]
+    return {'device': dict(zip(_DEVICE_COLUMNS, device)), 'history': history}
+
+# Start of the default report window; the window moves every day
+def default_since():
+    return (date.today() - timedelta(days=DEFAULT_WINDOW_DAYS)).isoformat()
+
+# Devices with at least min_rmas RMAs issued in [since, until]. Only devices whose lifetime
+# count already reaches min_rmas are considered, each counted from the (serial, date) index;
+# CROSS JOIN keeps SQLite from driving the join off the date index over every RMA instead.
+def repeat_failures(conn, min_rmas=DEFAULT_MIN_RMAS, since=None, until=None, limit=DEFAULT_REPORT_LIMIT):
+    if min_rmas < 2:
+        raise ValueError("min_rmas must be at least 2")
+    limit = max(1, min(int(limit), MAX_REPORT_LIMIT))
+    since = dates.parse_date(since) if since else default_since()
+    until = dates.parse_date(until) if until else '9999-12-31'
+    c = conn.cursor()
+    c.execute('''SELECT d.serial, COUNT(*) AS rmas, MIN(r.date_of_issue), MAX(r.date_of_issue),
+                        d.rma_count, d.product, d.si_client, d.last_status
+                 FROM devices d
+                 CROSS JOIN rma_requests r ON r.device_serial_number = d.serial
+                 WHERE d.rma_count >= ? AND r.date_of_issue BETWEEN ? AND ?
+                 GROUP BY d.serial
+                 HAVING COUNT(*) >= ?
+                 ORDER BY rmas DESC, d.serial
+                 LIMIT ?''', (min_rmas, since, until, min_rmas, limit))
+    devices = [{'serial': serial, 'rmas_in_window': rmas, 'first_in_window': first, 'last_in_window': last,
+                'rma_count': total, 'product': product, 'si_client': si_client, 'last_status': status}
+               for serial, rmas, first, last, total, product, si_client, status in c.fetchall()]
+    return {'min_rmas': min_rmas, 'since': since, 'until': until, 'devices': devices}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    conn = db.get_connection()
+    if command == 'rebuild':
+        with conn:
+            rebuild(conn.cursor())
+    elif command == 'check':
+        problems = check(conn.cursor())
+        for problem in problems:
+            print(f"{problem['serial']!r}: index {problem['actual']}, scan {problem['expected']}")
+        print("Device index consistent" if not problems else f"{len(problems)} mismatched devices")
+        sys.exit(1 if problems else 0)
+    else:
+        print("Usage: python devices.py [rebuild|check]")
+        sys.exit(2)
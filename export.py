@@ -0,0 +1,97 @@
+import io
+import csv
+import json
+import tempfile
+import listing
+import search
+
+# (column, header) in export order
+EXPORT_COLUMNS = (
+    ('token_no', 'token_no'), ('month', 'month'), ('date_of_issue', 'date_of_issue'),
+    ('project', 'project'), ('location', 'location'), ('si_client', 'si_client'),
+    ('product', 'product'), ('device_serial_number', 'Device Serial Number'),
+    ('delivered_material_date', 'delivered_material_date'), ('issues_observed', 'issues_observed'),
+    ('emd_observation', 'emd_observation'), ('solutions', 'solutions'),
+    ('replacement_dc_no', 'replacement_dc_no'), ('tested_by_messung_engineer', 'tested_by_messung_engineer'),
+    ('rma', 'rma'), ('faulty_device_status', 'faulty_device_status'), ('remark', 'remark'),
+    ('device_status', 'device_status'), ('r1', 'r1'), ('r2', 'r2'), ('r3', 'r3'),
+    ('customer_email', 'customer_email')
+)
+EXPORT_HEADERS = [header for _, header in EXPORT_COLUMNS]
+
+# Rows pulled from SQLite per fetch; bounds memory regardless of table size
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'RMA_export.xlsx'),
+    'csv': ('text/csv', 'RMA_export.csv'),
+    'ndjson': ('application/x-ndjson', 'RMA_export.ndjson'),
+}
+
+# Export query honouring the listing filters and an optional search term
+def build_query(args):
+    clauses, params = listing.build_filters(args)
+    clause, search_params = search.search_clause(args.get('search_term', ''), args.get('search_type', 'rma'))
+    if clause:
+        clauses.append(clause)
+        params.extend(search_params)
+    query = "SELECT " + ", ".join(column for column, _ in EXPORT_COLUMNS) + " FROM rma_requests"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY id"
+    return query, params
+
+# Stream rows from the cursor in chunks
+def iter_rows(conn, query, params, chunk_size=EXPORT_CHUNK_SIZE):
+    c = conn.cursor()
+    c.execute(query, params)
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+# openpyxl is imported on first xlsx export rather than at startup
+def preload():
+    import openpyxl.workbook
+
+# Write rows to fileobj, by default an anonymous per-request temp file; openpyxl's
+# write-only mode keeps memory flat
+def build_xlsx(rows, fileobj=None):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(EXPORT_HEADERS)
+    try:
+        for row in rows:
+            ws.append(row)
+    except BaseException:
+        # Release openpyxl's temp sheet now rather than when the workbook is garbage collected
+        ws.close()
+        raise
+    fileobj = fileobj or tempfile.TemporaryFile()
+    wb.save(fileobj)
+    fileobj.seek(0)
+    return fileobj
+
+def iter_csv(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_ndjson(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_HEADERS, row))) + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
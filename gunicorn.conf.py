@@ -0,0 +1,53 @@
+# Loaded automatically by `gunicorn app:app` from the project root.
+# Bind address and worker count keep gunicorn's defaults ($PORT, $WEB_CONCURRENCY).
+import os
+import time
+import logging
+
+logger = logging.getLogger('gunicorn.error')
+
+# Import the app once in the master; workers are forked from it with every module
+# already loaded, so respawned workers serve their first request immediately
+preload_app = os.getenv('PRELOAD_APP', '1') == '1'
+
+# SERVING_MODE=gthread runs each worker as a thread pool: a slow export or render holds one
+# thread instead of the whole worker, idle keep-alive connections cost nothing, and the worker
+# keeps heartbeating during long requests. Each thread gets its own SQLite connection (db.py).
+SERVING_MODE = os.getenv('SERVING_MODE', 'sync')
+if SERVING_MODE == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.getenv('THREADS', 8))
+    keepalive = int(os.getenv('KEEPALIVE', 5))
+elif SERVING_MODE != 'sync':
+    raise RuntimeError(f"Unknown SERVING_MODE: {SERVING_MODE}")
+
+_boot_start = time.perf_counter()
+
+# Runs once in the master before any worker exists, so no worker ever sees a missing table.
+# With preload_app the app import has already migrated and this is a single PRAGMA read.
+def on_starting(server):
+    import db
+    import schema
+    start = time.perf_counter()
+    applied = schema.migrate()
+    logger.info(f"Schema at version {schema.SCHEMA_VERSION} ({'applied ' + str(applied) if applied else 'up to date'}) "
+                f"in {time.perf_counter() - start:.3f}s")
+    if preload_app:
+        import app
+        app.warm_up()
+    # Workers must open their own connections rather than inherit the master's
+    db.close_all()
+
+def when_ready(server):
+    logger.info(f"Master ready in {time.perf_counter() - _boot_start:.3f}s "
+                f"(preload_app={preload_app}, serving_mode={SERVING_MODE})")
+
+def post_fork(server, worker):
+    worker.fork_time = time.perf_counter()
+
+def post_worker_init(worker):
+    import mailer
+    # Mail queued before a restart, or waiting on a retry backoff, goes out without waiting
+    # for this worker to queue a new message
+    mailer.notify_worker()
+    logger.info(f"Worker {worker.pid} ready in {time.perf_counter() - worker.fork_time:.3f}s after fork")
@@ -1,91 +1,213 @@
-import pandas as pd
-import sqlite3
 import os
+import sys
+import time
+import hashlib
+import argparse
+from itertools import islice
+import db
+import dates
+import tokens
 
-# Connect to SQLite database
-db_path = os.path.join(os.path.dirname(__file__), 'rma.db')
-try:
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-except sqlite3.DatabaseError as e:
-    print(f"Error connecting to database: {e}")
-    exit(1)
+# Spreadsheet header -> rma_requests column
+COLUMN_MAP = {
+    'Month': 'month',
+    'Date of Issue': 'date_of_issue',
+    'Project': 'project',
+    'Location': 'location',
+    'SI/Client': 'si_client',
+    'Product': 'product',
+    'Device Serial Number': 'device_serial_number',
+    'Delivered Material Date': 'delivered_material_date',
+    'Issues Observed': 'issues_observed',
+    'EMD Observation': 'emd_observation',
+    'Solutions': 'solutions',
+    'Replacement DC No': 'replacement_dc_no',
+    'Tested By Messung Engineer': 'tested_by_messung_engineer',
+    'RMA': 'rma',
+    'Faulty Device Status': 'faulty_device_status',
+    'Remark': 'remark',
+    'Device Status': 'device_status',
+    'R1': 'r1',
+    'R2': 'r2',
+    'R3': 'r3',
+    'Customer Email': 'customer_email',
+}
+DEFAULT_CUSTOMER_EMAIL = 'client@example.com'
+DEFAULT_CHUNK_SIZE = 10000
+# Stay under SQLite's bound-parameter limit when looking up existing serials
+LOOKUP_BATCH_SIZE = 900
 
-# Create or verify rma_sequence table
-c.execute('''CREATE TABLE IF NOT EXISTS rma_sequence (
-                id INTEGER PRIMARY KEY,
-                last_sequence INTEGER
-            )''')
-c.execute("INSERT OR IGNORE INTO rma_sequence (id, last_sequence) VALUES (1, 440)")
-conn.commit()
+INSERT_COLUMNS = list(COLUMN_MAP.values()) + ['token_no']
+INSERT_SQL = (f"INSERT INTO rma_requests ({', '.join(INSERT_COLUMNS)}) "
+              f"VALUES ({', '.join('?' for _ in INSERT_COLUMNS)})")
 
-# Generate sequential RMA token
-def generate_rma_token():
-    c.execute("SELECT last_sequence FROM rma_sequence WHERE id = 1")
-    result = c.fetchone()
-    last_sequence = result[0] if result else 440
-    new_sequence = last_sequence + 1
-    c.execute("UPDATE rma_sequence SET last_sequence = ? WHERE id = 1", (new_sequence,))
-    conn.commit()
-    return f"MES-RMA-{new_sequence}"
+# Checkpoint table so an interrupted import can resume where it stopped
+def init_import(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS import_progress (
+                    source TEXT PRIMARY KEY,
+                    filename TEXT,
+                    rows_done INTEGER NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )''')
 
-# Read Excel file
-excel_path = os.path.join(os.path.dirname(__file__), 'rma_data.xlsx')
-try:
-    df = pd.read_excel(excel_path)
-except FileNotFoundError:
-    print(f"Error: rma_data.xlsx not found at {excel_path}")
-    conn.close()
-    exit(1)
-except PermissionError:
-    print(f"Error: Permission denied for rma_data.xlsx. Ensure file is not open or locked.")
-    conn.close()
-    exit(1)
-except Exception as e:
-    print(f"Error reading Excel file: {e}")
-    conn.close()
-    exit(1)
+# Imports are keyed on file content, so a renamed file still resumes and an edited one starts over
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-# Insert data into rma_requests
-for index, row in df.iterrows():
-    token_no = generate_rma_token()
-    customer_email = str(row.get('Customer Email', 'client@example.com'))
+# Yield (raw row count, DataFrame) chunks with the spreadsheet's own headers
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, sheet=None, skip_rows=0):
+    # pandas and openpyxl load on first use, so importing this module (e.g. from the app) stays cheap
+    import pandas as pd
+    from openpyxl import load_workbook
+    if path.lower().endswith('.csv'):
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                             skiprows=range(1, skip_rows + 1))
+        for df in reader:
+            yield len(df), df
+        return
+    wb = load_workbook(path, read_only=True, data_only=True)
     try:
-        c.execute('''INSERT INTO rma_requests (
-            month, date_of_issue, project, location, si_client, product, 
-            device_serial_number, delivered_material_date, issues_observed, 
-            emd_observation, solutions, replacement_dc_no, tested_by_messung_engineer, 
-            rma, faulty_device_status, remark, device_status, r1, r2, r3, 
-            token_no, customer_email
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-        (
-            str(row.get('Month', '')),
-            str(row.get('Date of Issue', '')),
-            str(row.get('Project', '')),
-            str(row.get('Location', '')),
-            str(row.get('SI/Client', '')),
-            str(row.get('Product', '')),
-            str(row.get('Device Serial Number', '')),  # Changed to Device Serial Number
-            str(row.get('Delivered Material Date', '')),
-            str(row.get('Issues Observed', '')),
-            str(row.get('EMD Observation', '')),
-            str(row.get('Solutions', '')),
-            str(row.get('Replacement DC No', '')),
-            str(row.get('Tested By Messung Engineer', '')),
-            str(row.get('RMA', '')),
-            str(row.get('Faulty Device Status', '')),
-            str(row.get('Remark', '')),
-            str(row.get('Device Status', '')),
-            str(row.get('R1', '')),
-            str(row.get('R2', '')),
-            str(row.get('R3', '')),
-            token_no,
-            customer_email
-        ))
-    except sqlite3.IntegrityError as e:
-        print(f"Error inserting row {index}: {e}")
-        continue
+        ws = wb[sheet] if sheet else wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        rows = islice(rows, skip_rows, None)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield len(chunk), pd.DataFrame(chunk, columns=header)
+    finally:
+        wb.close()
+
+# Map spreadsheet columns onto rma_requests and clean values, a whole column at a time
+def normalize(df):
+    import pandas as pd
+    df = df.rename(columns=lambda name: str(name).strip()).dropna(how='all')
+    out = pd.DataFrame(index=df.index)
+    for header, column in COLUMN_MAP.items():
+        series = df[header] if header in df.columns else pd.Series('', index=df.index, dtype='object')
+        text = series.astype('string').fillna('').str.strip()
+        if column in dates.DATE_COLUMNS:
+            # Excel date cells become ISO dates; text dates such as dd-mm-yy are parsed the way the app does
+            parsed = pd.to_datetime(series, errors='coerce', format='ISO8601')
+            text = text.mask(parsed.notna(), parsed.dt.strftime('%Y-%m-%d')).map(dates.to_iso)
+        out[column] = text.astype(object)
+    out['customer_email'] = out['customer_email'].replace('', DEFAULT_CUSTOMER_EMAIL)
+    return out
+
+# Serial+date keys already present in the database for this chunk's serials
+def existing_keys(conn, serials):
+    keys = set()
+    c = conn.cursor()
+    for i in range(0, len(serials), LOOKUP_BATCH_SIZE):
+        batch = serials[i:i + LOOKUP_BATCH_SIZE]
+        c.execute(f"SELECT device_serial_number, date_of_issue FROM rma_requests "
+                  f"WHERE device_serial_number IN ({', '.join('?' for _ in batch)})", batch)
+        keys.update(f"{serial}\x1f{date or ''}" for serial, date in c.fetchall())
+    return keys
 
-conn.commit()
-conn.close()
-print("Excel data imported successfully!")
\ No newline at end of file
+def save_progress(conn, source, path, rows_done, completed=False):
+    conn.execute('''INSERT INTO import_progress (source, filename, rows_done, completed, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (source) DO UPDATE SET rows_done = excluded.rows_done,
+                        completed = excluded.completed, filename = excluded.filename,
+                        updated_at = excluded.updated_at''',
+                 (source, os.path.basename(path), rows_done, int(completed), time.time()))
+
+def import_file(path, chunk_size=DEFAULT_CHUNK_SIZE, sheet=None, dry_run=False, resume=False, progress=None):
+    start = time.perf_counter()
+    conn = db.get_connection()
+    with conn:
+        init_import(conn.cursor())
+    source = file_digest(path)
+    skip_rows, completed = 0, False
+    if resume:
+        result = conn.execute("SELECT rows_done, completed FROM import_progress WHERE source = ?", (source,)).fetchone()
+        if result:
+            skip_rows, completed = result[0], bool(result[1])
+    report = {
+        'file': path, 'dry_run': dry_run, 'resumed_at_row': skip_rows, 'rows_read': 0,
+        'inserted': 0, 'duplicates_in_database': 0, 'duplicates_in_file': 0,
+        'first_token': None, 'last_token': None, 'already_complete': completed,
+    }
+    if completed:
+        report['seconds'] = round(time.perf_counter() - start, 2)
+        return report
+    seen = set()
+    rows_done = skip_rows
+    for raw_count, df in read_chunks(path, chunk_size, sheet, skip_rows):
+        rows = normalize(df)
+        report['rows_read'] += len(rows)
+        has_serial = rows['device_serial_number'] != ''
+        keys = rows['device_serial_number'] + '\x1f' + rows['date_of_issue']
+        serials = rows.loc[has_serial, 'device_serial_number'].unique().tolist()
+        in_file = has_serial & (keys.isin(seen) | keys.duplicated())
+        in_database = has_serial & ~in_file & keys.isin(existing_keys(conn, serials))
+        seen.update(keys[has_serial])
+        new_rows = rows[~(in_database | in_file)]
+        report['duplicates_in_database'] += int(in_database.sum())
+        report['duplicates_in_file'] += int(in_file.sum())
+        rows_done += raw_count
+        if not dry_run:
+            # One transaction per chunk: tokens, rows and checkpoint commit together
+            with conn:
+                block = tokens.reserve_tokens(conn, len(new_rows))
+                if block:
+                    records = new_rows.assign(token_no=block)[INSERT_COLUMNS].itertuples(index=False, name=None)
+                    conn.executemany(INSERT_SQL, records)
+                    report['first_token'] = report['first_token'] or block[0]
+                    report['last_token'] = block[-1]
+                save_progress(conn, source, path, rows_done)
+        report['inserted'] += len(new_rows)
+        if progress:
+            progress(report)
+    if not dry_run:
+        with conn:
+            save_progress(conn, source, path, rows_done, completed=True)
+    report['seconds'] = round(time.perf_counter() - start, 2)
+    return report
+
+def print_report(report):
+    verb = 'Would insert' if report['dry_run'] else 'Inserted'
+    print(f"{'Dry run for' if report['dry_run'] else 'Imported'} {report['file']}")
+    if report['already_complete']:
+        print("  Already imported completely; nothing to resume.")
+        return
+    if report['resumed_at_row']:
+        print(f"  Resumed after row:        {report['resumed_at_row']}")
+    print(f"  Rows read:                {report['rows_read']}")
+    print(f"  {verb + ':':<26}{report['inserted']}")
+    print(f"  Duplicates in database:   {report['duplicates_in_database']}")
+    print(f"  Duplicates within file:   {report['duplicates_in_file']}")
+    if report['first_token']:
+        print(f"  Tokens:                   {report['first_token']} to {report['last_token']}")
+    print(f"  Time:                     {report['seconds']}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import historical RMA records from Excel or CSV.")
+    parser.add_argument('path', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rma_data.xlsx'))
+    parser.add_argument('--database', help="SQLite database (default: DATABASE_PATH or rma.db)")
+    parser.add_argument('--sheet', help="Worksheet name (default: the active sheet)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="Report what would be imported without writing")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted import of the same file")
+    args = parser.parse_args()
+    if args.database:
+        db.DATABASE_PATH = args.database
+    import schema
+    schema.migrate()
+    try:
+        print_report(import_file(args.path, args.chunk_size, args.sheet, args.dry_run, args.resume))
+    except FileNotFoundError:
+        print(f"Error: {args.path} not found")
+        sys.exit(1)
+    except PermissionError:
+        print(f"Error: Permission denied for {args.path}. Ensure file is not open or locked.")
+        sys.exit(1)
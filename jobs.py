@@ -0,0 +1,452 @@
+import os
+import glob
+import json
+import time
+import uuid
+import signal
+import socket
+import argparse
+import logging
+import multiprocessing
+import sqlite3
+import threading
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+import db
+import export
+import import_excel
+import metrics
+import search
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Result files (kept RESULT_TTL after the job finishes) and uploaded spreadsheets (removed once imported)
+JOB_DIR = os.getenv('JOB_DIR', 'job_files')
+# Runner threads per web worker. Jobs are mostly Python-bound (openpyxl, pandas), so threads in
+# one process share the GIL; for parallel jobs across cores set JOB_WORKER=off and run
+# `python jobs.py --processes N` next to the web server
+JOB_THREADS = int(os.getenv('JOB_THREADS', 2))
+POLL_INTERVAL = 2
+# Progress is written at most this often
+PROGRESS_INTERVAL = 0.5
+# SQLite VM instructions between cancellation checks inside a single long statement
+INTERRUPT_STEPS = 100000
+RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', 86400))
+CLEANUP_INTERVAL = 600
+# Recording a job's outcome waits out other writers (a reindex holds the write lock for its whole run)
+FINISH_ATTEMPTS = 5
+MAX_UPLOAD_BYTES = int(os.getenv('JOB_MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+UPLOAD_EXTENSIONS = ('.xlsx', '.xlsm', '.csv')
+DEFAULT_LIST_LIMIT = 50
+
+# Queue of long-running work; runners claim rows, report progress and store results here
+def init_jobs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    progress REAL,
+                    message TEXT,
+                    result TEXT,
+                    result_path TEXT,
+                    result_name TEXT,
+                    result_mimetype TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+class JobCancelled(Exception):
+    pass
+
+# Cancelling a running job drops a marker file rather than writing the jobs table: the job may
+# be holding SQLite's write lock itself, and the marker is visible to every process on the host
+def _cancel_marker(job_id):
+    return os.path.join(JOB_DIR, 'cancel', str(job_id))
+
+# Handed to each job function: parameters, throttled progress reporting and cancellation checks.
+# Progress goes through the runner's own connection, so it is visible while the job's connection
+# is still inside a transaction.
+class JobContext:
+    def __init__(self, job_id, params, control):
+        self.job_id = job_id
+        self.params = params
+        self.control = control
+        self.cancelled = False
+        self.result_file = None
+        self._last_progress = 0
+        self.marker = _cancel_marker(job_id)
+
+    # Record progress (fraction 0..1 and/or a message); raises JobCancelled once cancel is requested
+    def progress(self, fraction=None, message=None, force=False):
+        if self.check_cancelled():
+            raise JobCancelled()
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        try:
+            self.control.execute("UPDATE jobs SET progress = COALESCE(?, progress), message = COALESCE(?, message) "
+                                 "WHERE id = ?", (fraction, message, self.job_id))
+            self.control.commit()
+        except sqlite3.OperationalError as e:
+            # Another job holds the write lock; progress is advisory, so skip this update
+            logger.debug(f"Job {self.job_id} progress not recorded: {e}")
+
+    def check_cancelled(self):
+        self.cancelled = self.cancelled or os.path.exists(self.marker)
+        return self.cancelled
+
+    # Yield items, reporting done/total every `every` items
+    def track(self, items, total, every=1000):
+        for i, item in enumerate(items, 1):
+            if i % every == 0:
+                self.progress(i / total if total else None, f"{i} of {total} rows")
+            yield item
+
+    # Abort the connection's current statement once cancellation is requested; SQLite raises
+    # OperationalError('interrupted') and the enclosing transaction rolls back
+    @contextmanager
+    def interruptible(self, conn):
+        conn.set_progress_handler(self.check_cancelled, INTERRUPT_STEPS)
+        try:
+            yield
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    # Path for this job's downloadable result
+    def set_result_file(self, name, mimetype):
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, f"{self.job_id}-{name}")
+        self.result_file = (path, name, mimetype)
+        return path
+
+    def discard_result_file(self):
+        if self.result_file and os.path.exists(self.result_file[0]):
+            os.remove(self.result_file[0])
+        self.result_file = None
+
+def _check_export(params):
+    if params.get('format', 'xlsx') not in export.EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {params.get('format')}")
+    export.build_query(params)
+
+def _run_export(ctx, conn):
+    export_format = ctx.params.get('format', 'xlsx')
+    mimetype, download_name = export.EXPORT_FORMATS[export_format]
+    query, params = export.build_query(ctx.params)
+    total = conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+    rows = ctx.track(export.iter_rows(conn, query, params), total)
+    path = ctx.set_result_file(download_name, mimetype)
+    with metrics.timed(metrics.export_build_seconds, export_format):
+        if export_format == 'xlsx':
+            with open(path, 'wb') as f:
+                export.build_xlsx(rows, f)
+        else:
+            chunks = export.iter_csv(rows) if export_format == 'csv' else export.iter_ndjson(rows)
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+    return {'rows': total}
+
+# Only files stored by save_upload() can be imported (and are deleted afterwards)
+def _check_import(params):
+    upload_dir = os.path.realpath(os.path.join(JOB_DIR, 'uploads'))
+    path = os.path.realpath(params.get('path') or '')
+    if os.path.dirname(path) != upload_dir or not os.path.isfile(path):
+        raise ValueError("Import jobs need an uploaded file")
+
+# Resumes by file content, so re-uploading a cancelled or failed import continues where it stopped
+def _run_import(ctx, conn):
+    def on_chunk(report):
+        ctx.progress(message=f"{report['rows_read']} rows read, {report['inserted']} inserted")
+    try:
+        report = import_excel.import_file(ctx.params['path'], sheet=ctx.params.get('sheet') or None,
+                                          dry_run=bool(ctx.params.get('dry_run')), resume=True, progress=on_chunk)
+    finally:
+        if os.path.exists(ctx.params['path']):
+            os.remove(ctx.params['path'])
+    report['file'] = ctx.params.get('filename', report['file'])
+    return report
+
+def _no_params(params):
+    pass
+
+def _run_reindex(ctx, conn):
+    with ctx.interruptible(conn), conn:
+        search.rebuild_index(conn.cursor())
+    return {}
+
+def _run_stats_rebuild(ctx, conn):
+    with ctx.interruptible(conn), conn:
+        stats.rebuild(conn.cursor())
+    return {}
+
+# kind -> (validate(params) raising ValueError, run(context, connection) returning a JSON-able result)
+KINDS = {
+    'export': (_check_export, _run_export),
+    'import': (_check_import, _run_import),
+    'reindex': (_no_params, _run_reindex),
+    'stats_rebuild': (_no_params, _run_stats_rebuild),
+}
+
+# Store an uploaded spreadsheet for an import job; returns its path
+def save_upload(storage):
+    filename = secure_filename(storage.filename or '')
+    if not filename.lower().endswith(UPLOAD_EXTENSIONS):
+        raise ValueError(f"Upload must be one of: {', '.join(UPLOAD_EXTENSIONS)}")
+    directory = os.path.join(JOB_DIR, 'uploads')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4().hex}-{filename}")
+    storage.save(path)
+    return path
+
+# Queue a job in the caller's transaction; raises ValueError for an unknown kind or bad parameters
+def submit(conn, kind, params):
+    if kind not in KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    KINDS[kind][0](params)
+    c = conn.cursor()
+    c.execute("INSERT INTO jobs (kind, params, status, created_at) VALUES (?, ?, 'queued', ?)",
+              (kind, json.dumps(params), time.time()))
+    return c.lastrowid
+
+_JOB_COLUMNS = ('id', 'kind', 'status', 'progress', 'message', 'result', 'error', 'result_name',
+                'created_at', 'started_at', 'finished_at')
+
+def _job_dict(row):
+    job = dict(zip(_JOB_COLUMNS, row))
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['cancel_requested'] = job['status'] == 'running' and os.path.exists(_cancel_marker(job['id']))
+    job['has_result_file'] = job.pop('result_name') is not None
+    return job
+
+def get_job(conn, job_id):
+    row = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+def list_jobs(conn, status=None, limit=DEFAULT_LIST_LIMIT):
+    query = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs"
+    params = []
+    if status:
+        query += " WHERE status = ?"
+        params.append(status)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(max(1, min(int(limit), 500)))
+    return [_job_dict(row) for row in conn.execute(query, params).fetchall()]
+
+# (path, download name, mimetype) of a succeeded job's file, or None
+def get_result_file(conn, job_id):
+    row = conn.execute('''SELECT result_path, result_name, result_mimetype FROM jobs
+                          WHERE id = ? AND status = 'succeeded' AND result_path IS NOT NULL''', (job_id,)).fetchone()
+    return row if row and os.path.exists(row[0]) else None
+
+# A queued job is cancelled at once; a running one stops at its next progress check.
+# Returns the job's status afterwards, or None if there is no such job.
+def request_cancel(conn, job_id):
+    result = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if result is None:
+        return None
+    if result[0] == 'queued':
+        with conn:
+            conn.execute('''UPDATE jobs SET status = 'cancelled', finished_at = ?, message = 'Cancelled before start'
+                            WHERE id = ? AND status = 'queued' ''', (time.time(), job_id))
+    # Also covers a job claimed between the two statements above
+    result = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if result[0] == 'running':
+        os.makedirs(os.path.dirname(_cancel_marker(job_id)), exist_ok=True)
+        open(_cancel_marker(job_id), 'w').close()
+    return result[0]
+
+# Atomically take the oldest queued job
+def claim(conn):
+    result = conn.execute('''UPDATE jobs SET status = 'running', started_at = ?, worker = ?, progress = 0
+                             WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+                             RETURNING id, kind, params''', (time.time(), f"{socket.gethostname()}:{os.getpid()}")).fetchone()
+    conn.commit()
+    return result
+
+def finish(conn, ctx, status, result=None, error=None):
+    path, name, mimetype = ctx.result_file or (None, None, None)
+    for attempt in range(FINISH_ATTEMPTS):
+        try:
+            conn.execute('''UPDATE jobs SET status = ?, result = ?, error = ?, result_path = ?, result_name = ?,
+                                result_mimetype = ?, progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END,
+                                message = ?, finished_at = ?
+                            WHERE id = ?''',
+                         (status, json.dumps(result) if result is not None else None, error, path, name, mimetype,
+                          status, status.capitalize(), time.time(), ctx.job_id))
+            conn.commit()
+            break
+        except sqlite3.OperationalError:
+            if attempt == FINISH_ATTEMPTS - 1:
+                raise
+    if os.path.exists(ctx.marker):
+        os.remove(ctx.marker)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Fail jobs left 'running' by a process on this host that has since exited (a restarted or killed worker);
+# imports can simply be uploaded again, they resume after the last committed chunk
+def reap_orphans(conn):
+    host = socket.gethostname()
+    orphans = []
+    for job_id, worker, params in conn.execute("SELECT id, worker, params FROM jobs WHERE status = 'running'").fetchall():
+        worker_host, _, pid = (worker or '').rpartition(':')
+        if worker_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+            orphans.append((job_id, json.loads(params).get('path')))
+    for job_id, upload in orphans:
+        conn.execute('''UPDATE jobs SET status = 'failed', error = 'Worker process exited', finished_at = ?
+                        WHERE id = ? AND status = 'running' ''', (time.time(), job_id))
+        # The partial result file, upload and cancel marker the dead worker left behind
+        for stale in glob.glob(os.path.join(JOB_DIR, f"{job_id}-*")) + [upload, _cancel_marker(job_id)]:
+            if stale and os.path.exists(stale):
+                os.remove(stale)
+        logger.warning(f"Job {job_id} orphaned by an exited worker")
+    conn.commit()
+    return len(orphans)
+
+# Delete result files of jobs that finished more than RESULT_TTL ago; the job rows stay
+def cleanup(conn, ttl=RESULT_TTL):
+    rows = conn.execute('''SELECT id, result_path FROM jobs
+                           WHERE result_path IS NOT NULL AND finished_at < ?''', (time.time() - ttl,)).fetchall()
+    for job_id, path in rows:
+        if os.path.exists(path):
+            os.remove(path)
+        conn.execute("UPDATE jobs SET result_path = NULL, result_name = NULL WHERE id = ?", (job_id,))
+    conn.commit()
+    if rows:
+        logger.info(f"Removed files of {len(rows)} expired jobs")
+    return len(rows)
+
+_wake = threading.Condition()
+
+# One runner thread: claims a job, runs it on this thread's pooled connection and records the outcome
+class JobRunner(threading.Thread):
+    def __init__(self, index=0, poll_interval=POLL_INTERVAL):
+        super().__init__(name=f'job-runner-{index}', daemon=True)
+        self.index = index
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.last_cleanup = 0
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        with _wake:
+            _wake.notify_all()
+        self.join(timeout)
+
+    def run(self):
+        logger.info(f"Job runner {self.index} started")
+        control = db.connect()
+        while not self.stop_event.is_set():
+            try:
+                if self.index == 0 and time.time() - self.last_cleanup > CLEANUP_INTERVAL:
+                    self.last_cleanup = time.time()
+                    reap_orphans(control)
+                    cleanup(control)
+                job = claim(control)
+            except Exception as e:
+                logger.error(f"Job runner error: {e}")
+                job = None
+            if job:
+                self.execute(control, *job)
+            else:
+                with _wake:
+                    _wake.wait(self.poll_interval)
+        control.close()
+        logger.info(f"Job runner {self.index} stopped")
+
+    def execute(self, control, job_id, kind, params):
+        ctx = JobContext(job_id, json.loads(params), control)
+        logger.info(f"Job {job_id} ({kind}) started")
+        start = time.perf_counter()
+        result, error = None, None
+        conn = db.get_connection()
+        try:
+            ctx.progress(0, 'Started', force=True)
+            result = KINDS[kind][1](ctx, conn)
+            status = 'succeeded'
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if ctx.cancelled or isinstance(e, JobCancelled):
+                status = 'cancelled'
+            else:
+                status, error = 'failed', str(e)
+                logger.error(f"Job {job_id} ({kind}) failed: {e}")
+            ctx.discard_result_file()
+        seconds = time.perf_counter() - start
+        try:
+            finish(control, ctx, status, result, error)
+        except Exception as e:
+            logger.error(f"Could not record outcome of job {job_id}: {e}")
+        metrics.job_seconds.observe(seconds, kind, status)
+        logger.info(f"Job {job_id} ({kind}) {status} in {seconds:.2f}s")
+
+_runners = [None] * JOB_THREADS
+_runners_lock = threading.Lock()
+
+# Start (once per process) and nudge the runner pool; JOB_WORKER=off leaves jobs to `python jobs.py`
+def notify_runners():
+    if os.getenv('JOB_WORKER', 'thread') == 'off':
+        return
+    with _runners_lock:
+        for index in range(JOB_THREADS):
+            if _runners[index] is None or not _runners[index].is_alive():
+                _runners[index] = JobRunner(index)
+                _runners[index].start()
+    with _wake:
+        _wake.notify_all()
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+# Run `threads` runners in this process until SIGINT/SIGTERM; the job in progress is allowed to finish
+def serve(threads=1):
+    signal.signal(signal.SIGTERM, _interrupt)
+    runners = [JobRunner(index) for index in range(threads)]
+    for runner in runners:
+        runner.start()
+    try:
+        # Sleep rather than join: a signal arriving inside Thread.join() can leave the thread marked as finished
+        while any(runner.is_alive() for runner in runners):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for runner in runners:
+            runner.stop()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run background jobs queued through /api/jobs.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help="Runner processes (default: CPU count)")
+    parser.add_argument('--threads', type=int, default=1, help="Runner threads per process")
+    args = parser.parse_args()
+    import schema
+    schema.migrate()
+    db.close_all()
+    processes = [multiprocessing.Process(target=serve, args=(args.threads,), name=f'job-process-{n}')
+                 for n in range(args.processes)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
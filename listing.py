@@ -0,0 +1,139 @@
+import base64
+import json
+import dates
+
+# Columns of rma_requests in table order
+RMA_COLUMNS = (
+    'id', 'month', 'date_of_issue', 'project', 'location', 'si_client', 'product',
+    'device_serial_number', 'delivered_material_date', 'issues_observed',
+    'emd_observation', 'solutions', 'replacement_dc_no', 'tested_by_messung_engineer',
+    'rma', 'faulty_device_status', 'remark', 'device_status', 'r1', 'r2', 'r3',
+    'token_no', 'customer_email'
+)
+
+# Query-string filter name -> column (exact match, backed by an index)
+FILTER_COLUMNS = {
+    'status': 'device_status',
+    'product': 'product',
+    'client': 'si_client',
+    'month': 'month',
+}
+
+# Query-string filter name -> (column, operator) for inclusive date ranges, e.g. a quarter:
+# ?issued_from=2025-04-01&issued_to=2025-06-30
+RANGE_FILTERS = {
+    'issued_from': ('date_of_issue', '>='),
+    'issued_to': ('date_of_issue', '<='),
+    'delivered_from': ('delivered_material_date', '>='),
+    'delivered_to': ('delivered_material_date', '<='),
+}
+
+# Explicit column list, so rows map by name even after columns are added
+SELECT_COLUMNS = ', '.join(RMA_COLUMNS)
+
+# Columns the listing can sort by. Each has an index (the rowid makes it (column, id)) and a
+# (device_status, column) index, so pages are index seeks with or without a status filter.
+SORT_COLUMNS = ('id', 'month', 'date_of_issue', 'si_client', 'product', 'device_status', 'token_no')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Keyset cursors are an opaque base64 encoding of [sort value, id] of the last row served
+def encode_cursor(value, row_id):
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(row_id, int):
+        raise ValueError("Invalid cursor")
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise ValueError("Invalid cursor")
+    return value, row_id
+
+# (device_status, sort column) indexes behind status-filtered listings
+def init_sort_indexes(c):
+    for column in SORT_COLUMNS:
+        if column not in ('id', 'device_status'):
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_rma_status_{column} ON rma_requests (device_status, {column})")
+
+# Build WHERE clauses from request args, ignoring empty values; raises ValueError for a bad date
+def build_filters(args):
+    clauses = []
+    params = []
+    for name, column in FILTER_COLUMNS.items():
+        value = args.get(name, '').strip()
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    for name, (column, operator) in RANGE_FILTERS.items():
+        value = args.get(name, '').strip()
+        if value:
+            clauses.append(f"{column} {operator} ?")
+            params.append(dates.parse_date(value))
+    return clauses, params
+
+# Count matching rows; the unfiltered total comes from the trigger-maintained counter
+def count_rows(conn, clauses, params):
+    c = conn.cursor()
+    if not clauses:
+        c.execute("SELECT value FROM rma_counters WHERE name = 'total'")
+        result = c.fetchone()
+        if result:
+            return result[0]
+    query = "SELECT COUNT(*) FROM rma_requests"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    c.execute(query, params)
+    return c.fetchone()[0]
+
+# Keyset segments in page order, each (extra clauses, params) over the raw sort column.
+# SQLite puts NULLs first ascending and last descending; a NULL never satisfies a row-value
+# comparison, so NULL and non-NULL rows are fetched as separate index ranges.
+def _segments(sort, order, cursor):
+    op = '>' if order == 'asc' else '<'
+    if sort == 'id':
+        return [([f"id {op} ?"], [cursor[1]]) if cursor else ([], [])]
+    nulls = ([f"{sort} IS NULL"], [])
+    values = ([f"{sort} IS NOT NULL"], [])
+    if cursor:
+        value, row_id = cursor
+        if value is None:
+            nulls = ([f"{sort} IS NULL", f"id {op} ?"], [row_id])
+            values = None if order == 'desc' else values
+        else:
+            nulls = None if order == 'asc' else nulls
+            values = ([f"({sort}, id) {op} (?, ?)"], [value, row_id])
+    segments = [nulls, values] if order == 'asc' else [values, nulls]
+    return [segment for segment in segments if segment is not None]
+
+# Fetch one page ordered by (sort column, id), starting after the cursor row
+def fetch_page(conn, clauses, params, sort='id', order='asc', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Invalid sort column: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid sort order: {order}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    direction = order.upper()
+    order_by = f" ORDER BY id {direction}" if sort == 'id' else f" ORDER BY {sort} {direction}, id {direction}"
+    rows = []
+    c = conn.cursor()
+    for extra_clauses, extra_params in _segments(sort, order, decode_cursor(cursor) if cursor else None):
+        where = list(clauses) + extra_clauses
+        query = f"SELECT {SELECT_COLUMNS} FROM rma_requests"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        # Fetch one extra row to know whether another page exists
+        c.execute(query + order_by + " LIMIT ?", list(params) + extra_params + [limit + 1 - len(rows)])
+        rows.extend(dict(zip(RMA_COLUMNS, row)) for row in c.fetchall())
+        if len(rows) > limit:
+            break
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['id'] if sort == 'id' else last[sort], last['id'])
+    return rows, next_cursor
@@ -0,0 +1,219 @@
+import os
+import smtplib
+import logging
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# SMTP settings; point SMTP_HOST/SMTP_PORT at a local aiosmtpd with SMTP_STARTTLS=0 for testing
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
+SMTP_TIMEOUT = 30
+SENDER_EMAIL = os.getenv('SMTP_SENDER', 'payal.chaudhari@messung.com')
+# App-specific password; required in production. Empty skips login, e.g. for a local test server
+SENDER_PASSWORD = os.getenv('SMTP_PASSWORD', '')
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 5
+IDLE_TIMEOUT = 60
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+# A message left in 'sending' this long belongs to a dead worker and is claimed again. The
+# claim on the rest of a batch is refreshed before each delivery, so it only has to outlast one
+# message: connect and send, plus one reconnect and resend, each bounded by SMTP_TIMEOUT.
+CLAIM_TIMEOUT = 300
+
+# Create the outbox table
+def init_outbox(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS email_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    sent_at REAL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
+
+# Queue a message; runs inside the caller's transaction so it commits with the RMA change
+def enqueue(conn, recipient, subject, body):
+    if not recipient:
+        logger.warning(f"Not queuing email without recipient: {subject}")
+        return None
+    now = time.time()
+    c = conn.cursor()
+    c.execute('''INSERT INTO email_outbox (recipient, subject, body, status, next_attempt_at, created_at)
+                 VALUES (?, ?, ?, 'pending', ?, ?)''', (recipient, subject, body, now, now))
+    return c.lastrowid
+
+# Atomically mark a batch of due messages as ours
+def claim_batch(conn, limit=BATCH_SIZE):
+    now = time.time()
+    c = conn.cursor()
+    c.execute('''UPDATE email_outbox SET status = 'sending', claimed_at = ?
+                 WHERE id IN (
+                     SELECT id FROM email_outbox
+                     WHERE (status = 'pending' AND next_attempt_at <= ?)
+                        OR (status = 'sending' AND claimed_at < ?)
+                     ORDER BY next_attempt_at
+                     LIMIT ?
+                 )
+                 RETURNING id, recipient, subject, body, attempts''',
+              (now, now, now - CLAIM_TIMEOUT, limit))
+    rows = c.fetchall()
+    conn.commit()
+    return rows
+
+# Extend our claim on messages still waiting in the current batch
+def refresh_claim(conn, message_ids):
+    conn.execute(f"UPDATE email_outbox SET claimed_at = ? WHERE status = 'sending' "
+                 f"AND id IN ({', '.join('?' for _ in message_ids)})", (time.time(), *message_ids))
+    conn.commit()
+
+def mark_sent(conn, message_id):
+    conn.execute("UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                 (time.time(), message_id))
+    conn.commit()
+
+# Schedule a retry with exponential backoff, or give up after MAX_ATTEMPTS
+def mark_failed(conn, message_id, attempts, error):
+    attempts += 1
+    if attempts >= MAX_ATTEMPTS:
+        status, next_attempt_at = 'failed', time.time()
+    else:
+        status = 'pending'
+        next_attempt_at = time.time() + min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    conn.execute('''UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                    WHERE id = ?''', (status, attempts, next_attempt_at, str(error), message_id))
+    conn.commit()
+    return status
+
+# Background sender that drains the outbox over one reused SMTP session
+class OutboxWorker(threading.Thread):
+    def __init__(self, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        super().__init__(name='email-outbox', daemon=True)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.smtp = None
+        self.last_used = 0
+
+    def wake(self):
+        self.wake_event.set()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.wake_event.set()
+        self.join(timeout)
+
+    def run(self):
+        logger.info("Email outbox worker started")
+        while not self.stop_event.is_set():
+            try:
+                processed = self.process_batch()
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+                processed = 0
+            if not processed:
+                if self.smtp and time.time() - self.last_used > self.idle_timeout:
+                    self._disconnect()
+                self.wake_event.wait(self.poll_interval)
+                self.wake_event.clear()
+        self._disconnect()
+        logger.info("Email outbox worker stopped")
+
+    # Send one batch; returns the number of messages handled
+    def process_batch(self):
+        with db.get_connection() as conn:
+            batch = claim_batch(conn, self.batch_size)
+            for i, (message_id, recipient, subject, body, attempts) in enumerate(batch):
+                if i:
+                    refresh_claim(conn, [message[0] for message in batch[i:]])
+                try:
+                    self._deliver(recipient, subject, body)
+                    mark_sent(conn, message_id)
+                    metrics.smtp_messages.inc('sent')
+                    logger.info(f"Email {message_id} sent to {recipient}")
+                except Exception as e:
+                    self._disconnect()
+                    status = mark_failed(conn, message_id, attempts, e)
+                    metrics.smtp_messages.inc(status)
+                    logger.error(f"Email {message_id} to {recipient} failed ({status}): {e}")
+        return len(batch)
+
+    def _connect(self):
+        if self.smtp is None:
+            with metrics.timed(metrics.smtp_seconds, 'connect'):
+                smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+                if SMTP_STARTTLS:
+                    smtp.starttls()
+                if SENDER_PASSWORD:
+                    smtp.login(SENDER_EMAIL, SENDER_PASSWORD)
+            self.smtp = smtp
+        return self.smtp
+
+    def _disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+    def _deliver(self, recipient, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = SENDER_EMAIL
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        try:
+            smtp = self._connect()
+            with metrics.timed(metrics.smtp_seconds, 'send'):
+                smtp.sendmail(SENDER_EMAIL, recipient, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the pooled session while idle; reconnect once
+            self._disconnect()
+            smtp = self._connect()
+            with metrics.timed(metrics.smtp_seconds, 'send'):
+                smtp.sendmail(SENDER_EMAIL, recipient, msg.as_string())
+        self.last_used = time.time()
+
+_worker = None
+_worker_lock = threading.Lock()
+
+# Start (once per process) and nudge the in-process worker; EMAIL_WORKER=off leaves sending to `python mailer.py`
+def notify_worker():
+    global _worker
+    if os.getenv('EMAIL_WORKER', 'thread') == 'off':
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+    _worker.wake()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with db.get_connection() as conn:
+        init_outbox(conn.cursor())
+    worker = OutboxWorker()
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
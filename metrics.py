@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from bisect import bisect_left
+from flask import g, request, before_render_template, template_rendered
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Statements slower than this are logged with their SQL
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', 0.1))
+# Profiling is off unless PROFILE_REQUESTS=1; then ?_profile=1 or PROFILE_SAMPLE_RATE picks requests
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+_registry = []
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+# Prometheus text exposition of every metric in this process
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+http_request_seconds = Histogram('rma_http_request_duration_seconds', 'Request latency by route.',
+                                 ('route', 'method', 'status'))
+template_render_seconds = Histogram('rma_template_render_seconds', 'Jinja render time by template.', ('template',))
+db_query_seconds = Histogram('rma_db_query_seconds', 'SQLite statement execute time.', ('operation', 'table'))
+db_fetch_seconds = Counter('rma_db_fetch_seconds_total', 'Time spent fetching rows after execute.', ('operation', 'table'))
+db_slow_queries = Counter('rma_db_slow_queries_total', 'Statements slower than SLOW_QUERY_SECONDS.', ('operation', 'table'))
+db_connections_opened = Counter('rma_db_connections_opened_total', 'SQLite connections opened.')
+db_lock_wait_seconds = Histogram('rma_db_write_lock_wait_seconds',
+                                 'Time for the first write of a transaction, which waits for the write lock.')
+db_lock_timeouts = Counter('rma_db_lock_timeouts_total', 'Statements that failed with "database is locked".')
+smtp_seconds = Histogram('rma_smtp_seconds', 'SMTP time by step.', ('step',))
+smtp_messages = Counter('rma_smtp_messages_total', 'Outbox messages handled by result.', ('result',))
+export_build_seconds = Histogram('rma_export_build_seconds', 'Time to build an export file.', ('format',))
+startup_seconds = Histogram('rma_startup_seconds', 'Process startup time by phase.', ('phase',))
+job_seconds = Histogram('rma_job_seconds', 'Background job run time by kind and outcome.', ('kind', 'status'),
+                        buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600))
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+(\w+)', re.IGNORECASE)
+_WRITE_OPERATIONS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+_DML_OPERATIONS = _WRITE_OPERATIONS | {'SELECT', 'WITH'}
+_query_labels = {}
+
+# (operation, table) label for a statement; cached since the SQL text is almost always a constant
+def _query_label(sql):
+    label = _query_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        operation = words[0].upper() if words else ''
+        match = _TABLE_RE.search(sql) if operation in _DML_OPERATIONS else None
+        label = (operation, match.group(1) if match else '')
+        if len(_query_labels) < 1024:
+            _query_labels[sql] = label
+    return label
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def _timed(self, method, sql, parameters):
+        label = _query_label(sql)
+        # The first write of a transaction is where SQLite waits for the write lock
+        first_write = label[0] in _WRITE_OPERATIONS and not self.connection.in_transaction
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                db_lock_timeouts.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            db_query_seconds.observe(elapsed, *label)
+            if first_write:
+                db_lock_wait_seconds.observe(elapsed)
+            if elapsed >= SLOW_QUERY_SECONDS:
+                db_slow_queries.inc(*label)
+                logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(sql.split())[:500]}")
+            self._label = label
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    # Bulk fetches keep stepping the statement, so their time counts too; fetchone is left
+    # untimed since single-row lookups finish inside execute
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            db_fetch_seconds.inc(*getattr(self, '_label', ('', '')), amount=time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+# Connection factory for sqlite3.connect whose cursors time every statement
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        db_connections_opened.inc()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts bypass Cursor.execute, so route them through an instrumented cursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Time a block into a histogram: `with timed(smtp_seconds, 'send'):`
+@contextmanager
+def timed(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    if PROFILE_REQUESTS and (request.args.get('_profile') or random.random() < PROFILE_SAMPLE_RATE):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _after_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{request.endpoint or 'unmatched'}-{time.time():.6f}.prof")
+        profiler.dump_stats(path)
+        response.headers['X-Profile-File'] = path
+        logger.info(f"Profiled {request.method} {request.path} -> {path}")
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+    return response
+
+def _before_render(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+def _template_rendered(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        template_render_seconds.observe(time.perf_counter() - start, template.name or '')
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_template_rendered, app)
@@ -0,0 +1,144 @@
+import sys
+import time
+import sqlite3
+import logging
+import db
+import cache
+import changes
+import dates
+import devices
+import jobs
+import listing
+import mailer
+import search
+import stats
+import tokens
+
+logger = logging.getLogger(__name__)
+
+# Schema version 1: everything init_db() used to create. Every statement is IF NOT EXISTS,
+# so databases created before versioning (user_version 0) are brought up to date in place.
+def _initial_schema(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS rma_requests (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    month TEXT,
+                    date_of_issue TEXT,
+                    project TEXT,
+                    location TEXT,
+                    si_client TEXT,
+                    product TEXT,
+                    device_serial_number TEXT,
+                    delivered_material_date TEXT,
+                    issues_observed TEXT,
+                    emd_observation TEXT,
+                    solutions TEXT,
+                    replacement_dc_no TEXT,
+                    tested_by_messung_engineer TEXT,
+                    rma TEXT,
+                    faulty_device_status TEXT,
+                    remark TEXT,
+                    device_status TEXT,
+                    r1 TEXT,
+                    r2 TEXT,
+                    r3 TEXT,
+                    token_no TEXT UNIQUE,
+                    customer_email TEXT
+                )''')
+    tokens.init_sequence(c)
+    # Indexes backing the listing API filters
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_device_status ON rma_requests (device_status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_product ON rma_requests (product)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_si_client ON rma_requests (si_client)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_month ON rma_requests (month)")
+    # Row counter kept in sync by triggers so the listing total never scans the table
+    c.execute('''CREATE TABLE IF NOT EXISTS rma_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS rma_counters_insert AFTER INSERT ON rma_requests
+                 BEGIN
+                     UPDATE rma_counters SET value = value + 1 WHERE name = 'total';
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS rma_counters_delete AFTER DELETE ON rma_requests
+                 BEGIN
+                     UPDATE rma_counters SET value = value - 1 WHERE name = 'total';
+                 END''')
+    c.execute("INSERT OR IGNORE INTO rma_counters (name, value) SELECT 'total', COUNT(*) FROM rma_requests")
+    cache.init_version(c)
+    search.init_search(c)
+    mailer.init_outbox(c)
+    stats.init_stats(c)
+
+# Schema version 2: dd-mm-yy dates rewritten as ISO so they sort and range-filter on an index
+def _iso_dates(c):
+    # Recreate the full-text trigger as UPDATE OF its columns first, so rewriting every
+    # row's dates does not also rewrite the whole index
+    c.execute("DROP TRIGGER IF EXISTS rma_search_update")
+    search.init_search(c)
+    c.connection.create_function('iso_date', 1, dates.to_iso, deterministic=True)
+    for column in dates.DATE_COLUMNS:
+        c.execute(f"UPDATE rma_requests SET {column} = iso_date({column}) WHERE {column} IS NOT iso_date({column})")
+        logger.info(f"Converted {c.rowcount} {column} values to ISO dates")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_date_of_issue ON rma_requests (date_of_issue)")
+
+# (version, description, function(cursor)) in order; append new steps, never edit applied ones
+MIGRATIONS = [
+    (1, 'Initial schema', _initial_schema),
+    (2, 'ISO dates', _iso_dates),
+    # Per-device summaries and the serial -> RMA history index
+    (3, 'Device history', devices.init_devices),
+    # Append-only change log behind /api/changes
+    (4, 'Change log', changes.init_changes),
+    # Background job queue behind /api/jobs
+    (5, 'Jobs', jobs.init_jobs),
+    # (device_status, column) indexes so sorted listing pages never re-sort the matching rows
+    (6, 'Listing sort indexes', listing.init_sort_indexes),
+    # Trigram index so serial and client searches match substrings, not just word prefixes
+    (7, 'Substring search index', search.init_substring_search),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Bring the database to SCHEMA_VERSION; a single PRAGMA read when it is already current.
+# The write lock is taken before re-reading the version, so concurrent callers migrate once.
+def migrate(conn=None):
+    conn = conn or db.get_connection()
+    if get_version(conn) >= SCHEMA_VERSION:
+        return []
+    applied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = get_version(conn)
+        c = conn.cursor()
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            start = time.perf_counter()
+            step(c)
+            c.execute(f"PRAGMA user_version = {version}")
+            applied.append(version)
+            logger.info(f"Applied migration {version} ({description}) in {time.perf_counter() - start:.2f}s")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    conn = db.get_connection()
+    if command == 'migrate':
+        try:
+            applied = migrate(conn)
+        except sqlite3.Error as e:
+            print(f"Migration failed: {e}")
+            sys.exit(1)
+        print(f"Schema at version {get_version(conn)}" + (f" (applied {applied})" if applied else ''))
+    elif command == 'version':
+        print(f"Schema version {get_version(conn)}, code expects {SCHEMA_VERSION}")
+    else:
+        print("Usage: python schema.py [migrate|version]")
+        sys.exit(2)
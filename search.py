@@ -0,0 +1,134 @@
+import re
+import db
+
+# Columns mirrored into the full-text index
+FTS_COLUMNS = (
+    'device_serial_number', 'si_client', 'project', 'issues_observed',
+    'emd_observation', 'solutions', 'remark'
+)
+
+# Upper bound on rows returned by a single search
+SEARCH_LIMIT = 200
+
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# Columns also mirrored into the trigram index, so serial and client searches keep matching
+# any substring the way LIKE '%term%' did
+SUBSTRING_COLUMNS = ('device_serial_number', 'si_client')
+
+# Create the FTS5 table, its sync triggers and the exact RMA lookup index.
+# Exact serial lookups use the device history index (devices.init_devices).
+def init_search(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rma_rma ON rma_requests (rma)")
+    _init_fts(c, 'rma_search', FTS_COLUMNS)
+
+# Trigram index over SUBSTRING_COLUMNS; LIKE on its columns is answered from the index
+# for patterns of three or more characters
+def init_substring_search(c):
+    _init_fts(c, 'rma_substring', SUBSTRING_COLUMNS, "tokenize='trigram'")
+
+def _init_fts(c, table, fts_columns, options=None):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    exists = c.fetchone() is not None
+    columns = ', '.join(fts_columns)
+    new_columns = ', '.join(f"new.{col}" for col in fts_columns)
+    old_columns = ', '.join(f"old.{col}" for col in fts_columns)
+    c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+                     {columns}, content='rma_requests', content_rowid='id'{', ' + options if options else ''}
+                 )''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON rma_requests
+                  BEGIN
+                      INSERT INTO {table} (rowid, {columns}) VALUES (new.id, {new_columns});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON rma_requests
+                  BEGIN
+                      INSERT INTO {table} ({table}, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+                  END''')
+    # Only changes to indexed columns touch the index; status changes and closes skip it
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF {columns} ON rma_requests
+                  BEGIN
+                      INSERT INTO {table} ({table}, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+                      INSERT INTO {table} (rowid, {columns}) VALUES (new.id, {new_columns});
+                  END''')
+    if not exists:
+        # Backfill the index for databases created before it existed
+        _rebuild(c, table)
+
+def _rebuild(c, table):
+    c.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+# Rebuild the full-text and trigram indexes from rma_requests
+def rebuild_index(c):
+    _rebuild(c, 'rma_search')
+    _rebuild(c, 'rma_substring')
+
+# Turn user input into an FTS5 query: "quoted text" is a phrase, bare words are prefixes
+def build_match_query(term, column=None):
+    parts = []
+    for phrase, word in _TOKEN_RE.findall(term):
+        if phrase:
+            parts.append('"' + phrase.replace('"', '""') + '"')
+        elif word:
+            parts.append('"' + word.replace('"', '""') + '"*')
+    if not parts:
+        return None
+    query = ' AND '.join(parts)
+    if column:
+        query = f"{{{column}}} : ({query})"
+    return query
+
+# WHERE clause over rma_requests selecting every match, for unbounded consumers like export
+def search_clause(term, search_type='rma'):
+    term = term.strip()
+    if not term:
+        return None, []
+    if search_type == 'rma':
+        return "rma = ?", [term]
+    if search_type in SUBSTRING_COLUMNS:
+        return f"id IN (SELECT rowid FROM rma_substring WHERE {search_type} LIKE ?)", [f"%{term}%"]
+    column = search_type if search_type in FTS_COLUMNS else None
+    if search_type != 'all' and column is None:
+        raise ValueError(f"Invalid search type: {search_type}")
+    match = build_match_query(term, column)
+    if not match:
+        return "0", []
+    return "id IN (SELECT rowid FROM rma_search WHERE rma_search MATCH ?)", [match]
+
+# Run a search; returns rma_requests rows as sqlite3.Row, best match first
+def search(conn, term, search_type='rma', limit=SEARCH_LIMIT):
+    c = db.named_cursor(conn)
+    term = term.strip()
+    if not term:
+        return []
+    if search_type == 'rma':
+        c.execute("SELECT * FROM rma_requests WHERE rma = ? ORDER BY id LIMIT ?", (term, limit))
+        return c.fetchall()
+    if search_type in SUBSTRING_COLUMNS:
+        return _substring_search(c, term, search_type, limit)
+    column = search_type if search_type in FTS_COLUMNS else None
+    if search_type != 'all' and column is None:
+        raise ValueError(f"Invalid search type: {search_type}")
+    match = build_match_query(term, column)
+    if not match:
+        return []
+    c.execute('''SELECT r.* FROM rma_search
+                 JOIN rma_requests r ON r.id = rma_search.rowid
+                 WHERE rma_search MATCH ?
+                 ORDER BY rma_search.rank
+                 LIMIT ?''', (match, limit))
+    return c.fetchall()
+
+# Substring match on a serial or client column through the trigram index
+def _substring_search(c, term, column, limit):
+    results = []
+    if column == 'device_serial_number':
+        # An exact serial hit comes from the B-tree index and always ranks first
+        c.execute("SELECT * FROM rma_requests WHERE device_serial_number = ? ORDER BY id LIMIT ?", (term, limit))
+        results = c.fetchall()
+    seen = {row['id'] for row in results}
+    c.execute(f'''SELECT * FROM rma_requests
+                  WHERE id IN (SELECT rowid FROM rma_substring WHERE {column} LIKE ?)
+                  ORDER BY id
+                  LIMIT ?''', (f"%{term}%", limit + len(results)))
+    results.extend(row for row in c.fetchall() if row['id'] not in seen)
+    return results[:limit]
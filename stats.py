@@ -0,0 +1,123 @@
+import sys
+import logging
+import db
+
+logger = logging.getLogger(__name__)
+
+# Dashboard dimension -> rma_requests column; 'all' holds the overall counts
+DIMENSIONS = {
+    'all': None,
+    'status': 'device_status',
+    'month': 'month',
+    'product': 'product',
+    'client': 'si_client',
+    'engineer': 'tested_by_messung_engineer',
+}
+
+def _value_expr(column, prefix):
+    return "''" if column is None else f"IFNULL({prefix}{column}, '')"
+
+def _closed_expr(prefix):
+    return f"({prefix}device_status IS 'Closed')"
+
+def _add_sql(prefix):
+    return "\n".join(
+        f"INSERT INTO rma_stats (dimension, value, total, closed) "
+        f"VALUES ('{name}', {_value_expr(column, prefix)}, 1, {_closed_expr(prefix)}) "
+        f"ON CONFLICT (dimension, value) DO UPDATE SET total = total + 1, closed = closed + excluded.closed;"
+        for name, column in DIMENSIONS.items()
+    )
+
+def _remove_sql(prefix):
+    return "\n".join(
+        f"UPDATE rma_stats SET total = total - 1, closed = closed - {_closed_expr(prefix)} "
+        f"WHERE dimension = '{name}' AND value = {_value_expr(column, prefix)};\n"
+        f"DELETE FROM rma_stats WHERE dimension = '{name}' AND value = {_value_expr(column, prefix)} AND total <= 0;"
+        for name, column in DIMENSIONS.items()
+    )
+
+# Create the summary table and the triggers that keep it current on every write
+def init_stats(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rma_stats'")
+    exists = c.fetchone() is not None
+    c.execute('''CREATE TABLE IF NOT EXISTS rma_stats (
+                    dimension TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    closed INTEGER NOT NULL,
+                    PRIMARY KEY (dimension, value)
+                ) WITHOUT ROWID''')
+    tracked = ', '.join(column for column in DIMENSIONS.values() if column)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_stats_insert AFTER INSERT ON rma_requests
+                  BEGIN
+                      {_add_sql('new.')}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_stats_delete AFTER DELETE ON rma_requests
+                  BEGIN
+                      {_remove_sql('old.')}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS rma_stats_update AFTER UPDATE OF {tracked} ON rma_requests
+                  BEGIN
+                      {_remove_sql('old.')}
+                      {_add_sql('new.')}
+                  END''')
+    if not exists:
+        rebuild(c)
+
+def _scan_sql(name, column):
+    value = _value_expr(column, '')
+    return (f"SELECT '{name}', {value}, COUNT(*), SUM({_closed_expr('')}) "
+            f"FROM rma_requests GROUP BY {value}")
+
+# Recompute every summary row from a full scan of rma_requests
+def rebuild(c):
+    c.execute("DELETE FROM rma_stats")
+    for name, column in DIMENSIONS.items():
+        c.execute(f"INSERT INTO rma_stats (dimension, value, total, closed) {_scan_sql(name, column)}")
+    logger.info("Rebuilt RMA statistics")
+
+# Compare the summaries with a full scan; returns the rows that disagree
+def check(c):
+    mismatches = []
+    for name, column in DIMENSIONS.items():
+        c.execute(_scan_sql(name, column))
+        expected = {value: (total, closed) for _, value, total, closed in c.fetchall()}
+        c.execute("SELECT value, total, closed FROM rma_stats WHERE dimension = ?", (name,))
+        actual = {value: (total, closed) for value, total, closed in c.fetchall()}
+        for value in expected.keys() | actual.keys():
+            if expected.get(value) != actual.get(value):
+                mismatches.append({'dimension': name, 'value': value,
+                                   'expected': expected.get(value), 'actual': actual.get(value)})
+    return mismatches
+
+# Summary rows for one dimension (or all of them), O(groups)
+def get_stats(conn, dimension=None):
+    if dimension is not None and dimension not in DIMENSIONS:
+        raise ValueError(f"Invalid dimension: {dimension}")
+    names = [dimension] if dimension else list(DIMENSIONS)
+    result = {name: [] for name in names}
+    c = conn.cursor()
+    c.execute(f"SELECT dimension, value, total, closed FROM rma_stats "
+              f"WHERE dimension IN ({', '.join('?' for _ in names)}) ORDER BY dimension, value", names)
+    for name, value, total, closed in c.fetchall():
+        result[name].append({'value': value, 'total': total, 'open': total - closed, 'closed': closed})
+    return result
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    conn = db.get_connection()
+    if command == 'rebuild':
+        with conn:
+            c = conn.cursor()
+            init_stats(c)
+            rebuild(c)
+    elif command == 'check':
+        problems = check(conn.cursor())
+        for problem in problems:
+            print(f"{problem['dimension']}={problem['value']!r}: summary {problem['actual']}, scan {problem['expected']}")
+        print("Statistics consistent" if not problems else f"{len(problems)} mismatched rows")
+        sys.exit(1 if problems else 0)
+    else:
+        print("Usage: python stats.py [rebuild|check]")
+        sys.exit(2)
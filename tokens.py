@@ -0,0 +1,41 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = 'MES-RMA-'
+# Last sequence number issued before this database was created
+INITIAL_SEQUENCE = 489
+
+def format_token(sequence):
+    return f"{TOKEN_PREFIX}{sequence}"
+
+# Create the sequence table and seed it
+def init_sequence(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS rma_sequence (
+                    id INTEGER PRIMARY KEY,
+                    last_sequence INTEGER
+                )''')
+    c.execute("INSERT OR IGNORE INTO rma_sequence (id, last_sequence) VALUES (1, ?)", (INITIAL_SEQUENCE,))
+
+# Reserve `count` consecutive tokens inside the caller's transaction.
+# The increment takes the write lock and is undone by the caller's rollback, so
+# numbers are only consumed when the rows using them commit: no gaps, no duplicates.
+def reserve_tokens(conn, count=1):
+    if count < 1:
+        return []
+    c = conn.cursor()
+    c.execute("UPDATE rma_sequence SET last_sequence = last_sequence + ? WHERE id = 1 RETURNING last_sequence",
+              (count,))
+    result = c.fetchone()
+    if result is None:
+        init_sequence(c)
+        c.execute("UPDATE rma_sequence SET last_sequence = last_sequence + ? WHERE id = 1 RETURNING last_sequence",
+                  (count,))
+        result = c.fetchone()
+    last_sequence = result[0]
+    first_sequence = last_sequence - count + 1
+    logger.info(f"Reserved RMA tokens: {format_token(first_sequence)} to {format_token(last_sequence)}")
+    return [format_token(n) for n in range(first_sequence, last_sequence + 1)]
+
+def allocate_token(conn):
+    return reserve_tokens(conn, 1)[0]